@@ -10,6 +10,7 @@ class ControlButton(QAbstractButton):
         self.direction = direction
         self.setMouseTracking(True)
         self.is_hovered = False
+        self.is_hinted = False
 
         self.sfx = sfx
 
@@ -26,6 +27,11 @@ class ControlButton(QAbstractButton):
     def mouseReleaseEvent(self, e):
         return super().mouseReleaseEvent(e)
 
+    def set_hinted(self, hinted: bool):
+        if hinted != self.is_hinted:
+            self.is_hinted = hinted
+            self.update()
+
     def paintEvent(self, e):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.Antialiasing)
@@ -34,6 +40,10 @@ class ControlButton(QAbstractButton):
 
         if self.isDown():
             bg_color = QColor(170, 161, 148)
+        elif not self.isEnabled(): # ход в эту сторону невозможен
+            bg_color = QColor(224, 216, 207)
+        elif self.is_hinted:
+            bg_color = QColor(237, 194, 46)
         elif self.is_hovered:
             bg_color = QColor(187, 177, 164)
         else:
@@ -2,11 +2,12 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Callable, Optional, Dict, List, Tuple
 
-from PySide6.QtCore import Qt, QSize, QPropertyAnimation, QEasingCurve, QRect, QUrl
+from PySide6.QtCore import Qt, QSize, QPropertyAnimation, QEasingCurve, QRect, QUrl, QPointF
 from PySide6.QtWidgets import QWidget, QGridLayout, QFrame
-from PySide6.QtGui import QFont, QPainter, QColor
+from PySide6.QtGui import QFont, QPainter, QColor, QPixmap, QStaticText
 from PySide6.QtMultimedia import QSoundEffect
 
+from engine import DeltaBatch, MergeEvent, MoveEvent, SpawnEvent
 from sounds import SoundsEffects 
 
 color_map = {
@@ -27,17 +28,24 @@ font_color_map = {
     "dark": "#2f2f2f",
     "light": "#ffffff"
 }
+empty_color = "#CDC1B4" # как #GameSquare в style_2048.qss
+
+# Большие доски (режим до 32x32): вместо виджета на каждую клетку и тайл доска рисуется целиком в paintEvent,
+# детализация зависит от размера клетки на экране
+BULK_PAINT_SIZE = 9 # с этого размера доски
+TEXT_MIN_SIDE = 14 # в клетках меньше этого (в пикселях) текст не читается и не рисуется
+ROUNDED_MIN_SIDE = 8 # в клетках меньше этого углы не скругляются
 
 @dataclass
 class StepState:
     final_board: List[List[int]]
     final_id_board: List[List[int]]
-    move_events: List[Dict]
-    merge_events: List[Dict]
-    spawn_events: List[Dict]
-    despawn_events: List[Dict]
-    split_tile_events: List[Dict]
-    reverse_events: List[Dict]
+    move_events: List[MoveEvent]
+    merge_events: List[MergeEvent]
+    spawn_events: List[SpawnEvent]
+    despawn_events: List[SpawnEvent]
+    split_tile_events: List[MergeEvent]
+    reverse_events: List[MoveEvent]
     on_complete: Optional[Callable] = None
     running_animations: int = 0
     token: int = 0
@@ -64,10 +72,22 @@ class GameBoard(QWidget):
 
         self.sfx = sfx
 
+        # Режим больших досок: хранятся только занятые клетки, геометрия считается без layout
+        self.bulk = size >= BULK_PAINT_SIZE
+        self.tile_values: Dict[Tuple[int, int], int] = {}
+        self.cell_side = 0.0
+        self.cell_step = 0.0
+        self.border = 0
+        self.grid: Optional[QPixmap] = None # пустые клетки, рисуются один раз на размер доски
+        self.static_texts: Dict[int, QStaticText] = {}
+        self.static_texts_font = 0
+
         self._make_board_table()
         self.setMinimumSize(250, 250)
 
     def _make_board_table(self):
+        if self.bulk:
+            return
         for row in range(self.board_size):
             for col in range(self.board_size):
                 tile = EmptyTile(self)
@@ -90,6 +110,10 @@ class GameBoard(QWidget):
 
         border = max(4, side // 50)
 
+        if self.bulk:
+            self._update_bulk_geometry(side, border)
+            return
+
         self.main_layout.setContentsMargins(border, border, border, border)
         self.main_layout.setSpacing(border)
         self.main_layout.activate()
@@ -98,6 +122,11 @@ class GameBoard(QWidget):
 
     def set_full_state(self, board: List[List[int]], id_board: List[List[int]]):
         self.clear_tiles()
+        if self.bulk:
+            self.tile_values = {(r, c): value for r, row in enumerate(board) for c, value in enumerate(row) if value}
+            self.update()
+            return
+
         for r in range(self.board_size):
             for c in range(self.board_size):
                 value = board[r][c]
@@ -109,7 +138,7 @@ class GameBoard(QWidget):
 
     def play_step(
             self, 
-            delta: List[Dict], 
+            delta: DeltaBatch, 
             new_board: List[List[int]], 
             new_id_board: List[List[int]], 
             animated: bool = True, 
@@ -117,22 +146,31 @@ class GameBoard(QWidget):
             variant: str = "move"
             ):
         
+        if self.bulk:
+            # Анимации сотен тайлов не укладываются в кадр: доска перерисовывается сразу
+            if delta and animated and variant == "move":
+                self.sfx.play_swipe()
+            elif delta and animated:
+                self.sfx.play_short_swipe()
+            self.set_full_state(new_board, new_id_board)
+            if on_complete:
+                on_complete()
+            return
+
         if not delta or not animated:
             self.set_full_state(new_board, new_id_board)
             if on_complete:
                 on_complete()
             return
         
-        move_events, merge_events, spawn_events, despawn_events, split_tile_events, reverse_events = self._split_events(delta)
-
         if variant == "move":
-            if not move_events and not merge_events and not spawn_events:
+            if not delta.moves and not delta.merges and not delta.spawns:
                 self.set_full_state(new_board, new_id_board)
                 if on_complete:
                     on_complete()
                 return
         elif variant == "undo":
-            if not despawn_events and not reverse_events and not split_tile_events:
+            if not delta.despawns and not delta.reverses and not delta.splits:
                 self.set_full_state(new_board, new_id_board)
                 if on_complete:
                     on_complete()
@@ -144,12 +182,12 @@ class GameBoard(QWidget):
         step = StepState(
             final_board=new_board,
             final_id_board=new_id_board,
-            move_events=move_events,
-            merge_events=merge_events,
-            spawn_events=spawn_events,
-            despawn_events=despawn_events,
-            split_tile_events=split_tile_events,
-            reverse_events=reverse_events,
+            move_events=delta.moves,
+            merge_events=delta.merges,
+            spawn_events=delta.spawns,
+            despawn_events=delta.despawns,
+            split_tile_events=delta.splits,
+            reverse_events=delta.reverses,
             on_complete=on_complete,
             running_animations=0,
             token=token
@@ -194,6 +232,7 @@ class GameBoard(QWidget):
 
         self.tile_by_id.clear()
         self.id_to_pos.clear()
+        self.tile_values = {}
         self.current_step = None
 
     def _add_tile(self, tile_id, value: int, row: int, col: int):
@@ -221,32 +260,87 @@ class GameBoard(QWidget):
                 tile.setGeometry(cell_rect)
 
     def _get_cell_rect(self, row: int, col: int):
+        if self.bulk:
+            x = self.border + round(col * self.cell_step)
+            y = self.border + round(row * self.cell_step)
+            side = round(self.cell_side)
+            return QRect(x, y, max(1, side), max(1, side))
         return self.main_layout.cellRect(row, col)
-    
-    def _split_events(self, delta: List[Dict]) -> Tuple[List[Dict], List[Dict], List[Dict]]:
-        move_events: List[Dict] = []
-        merge_events: List[Dict] = []
-        spawn_events: List[Dict] = []
-        reverse_events: List[Dict] = []
-        despawn_events: List[Dict] = []
-        split_tile_events: List[Dict] = []
-
-        for event in delta:
-            t = event.get("type", "")
-            if t == "move":
-                move_events.append(event)
-            elif t == "merge":
-                merge_events.append(event)
-            elif t == "spawn":
-                spawn_events.append(event)
-            elif t == "despawn":
-                despawn_events.append(event)
-            elif t == "split":
-                split_tile_events.append(event)
-            elif t == "reverse":
-                reverse_events.append(event)
-
-        return move_events, merge_events, spawn_events, despawn_events, split_tile_events, reverse_events
+
+    def _update_bulk_geometry(self, side: int, border: int):
+        n = self.board_size
+        inner = side - 2 * border
+        spacing = max(1, round(inner / n / 10))
+        self.border = border
+        self.cell_side = (inner - spacing * (n - 1)) / n
+        self.cell_step = self.cell_side + spacing
+
+        ratio = self.devicePixelRatioF()
+        self.grid = QPixmap(round(side * ratio), round(side * ratio))
+        self.grid.setDevicePixelRatio(ratio)
+        self.grid.fill(Qt.transparent)
+        painter = QPainter(self.grid)
+        self._begin_cells(painter)
+        painter.setBrush(QColor(empty_color))
+        self._draw_cells(painter, [self._get_cell_rect(r, c) for r in range(n) for c in range(n)])
+        painter.end()
+        self.update()
+
+    def _begin_cells(self, painter: QPainter):
+        painter.setRenderHint(QPainter.Antialiasing, self.cell_side >= ROUNDED_MIN_SIDE)
+        painter.setPen(Qt.NoPen)
+
+    def _draw_cells(self, painter: QPainter, rects: List[QRect]):
+        if self.cell_side < ROUNDED_MIN_SIDE:
+            painter.drawRects(rects)
+            return
+        radius = min(12, self.cell_side / 8)
+        for rect in rects:
+            painter.drawRoundedRect(rect, radius, radius)
+
+    def paintEvent(self, event):
+        if not self.bulk:
+            return super().paintEvent(event)
+
+        painter = QPainter(self)
+        side = self.cell_side
+        if self.grid is not None:
+            painter.drawPixmap(0, 0, self.grid)
+        self._begin_cells(painter)
+
+        # Тайлы сгруппированы по значению: кисть и текст меняются раз на группу
+        by_value: Dict[int, List[QRect]] = {}
+        for (r, c), value in self.tile_values.items():
+            by_value.setdefault(value, []).append(self._get_cell_rect(r, c))
+        for value, rects in by_value.items():
+            painter.setBrush(QColor(color_map.get(value, "#3c3a32")))
+            self._draw_cells(painter, rects)
+
+        if side >= TEXT_MIN_SIDE:
+            font = QFont("Montserrat")
+            font.setPixelSize(max(3, round(side / 3.2)))
+            painter.setFont(font)
+            if self.static_texts_font != font.pixelSize():
+                self.static_texts.clear()
+                self.static_texts_font = font.pixelSize()
+            for value, rects in by_value.items():
+                painter.setPen(QColor(font_color_map["dark"] if value <= 4 else font_color_map["light"]))
+                text = self._static_text(value, font)
+                text_size = text.size()
+                dx = (side - text_size.width()) / 2
+                dy = (side - text_size.height()) / 2
+                for rect in rects:
+                    painter.drawStaticText(QPointF(rect.x() + dx, rect.y() + dy), text)
+        painter.end()
+
+    def _static_text(self, value: int, font: QFont) -> QStaticText:
+        # Раскладка текста кэшируется на значение: на плотной доске одинаковых тайлов сотни
+        text = self.static_texts.get(value)
+        if text is None:
+            text = QStaticText(short_value(value))
+            text.prepare(font=font)
+            self.static_texts[value] = text
+        return text
     
     def _play_moves(self, step: StepState):
         if self.current_step is not step or step.token != self.animation_token:
@@ -259,16 +353,13 @@ class GameBoard(QWidget):
         self.sfx.play_swipe()
         
         for event in step.move_events:
-            tile_id = event.get("id", None)
-            if tile_id is None:
-                continue
-
+            tile_id = event.tile_id
             tile = self.tile_by_id.get(tile_id, None)
             if tile is None:
                 continue
 
-            from_row, from_col = event["from"]
-            to_row, to_col = event["to"]
+            from_row, from_col = event.from_pos
+            to_row, to_col = event.to_pos
 
             start_rect = self._get_cell_rect(from_row, from_col)
             end_rect = self._get_cell_rect(to_row, to_col)
@@ -296,11 +387,13 @@ class GameBoard(QWidget):
         if not step.merge_events:
             return
 
+        # В итоговой дельте серии ходов тайл может поглотить несколько других или появиться в этом же шаге.
+        # Вторая анимация geometry того же тайла остановила бы первую без finished, поэтому тайл анимируется один раз
+        animated = {event.tile_id for event in step.spawn_events}
+
         for event in step.merge_events:
-            from_ids = event.get("from_ids", (None, None))
-            new_id = event.get("new_id", None)
-            if None in from_ids or new_id is None:
-                continue
+            from_ids = event.from_ids
+            new_id = event.new_id
 
             tile_winner = self.tile_by_id.get(new_id, None)
             if tile_winner is None:
@@ -312,14 +405,18 @@ class GameBoard(QWidget):
             if loser_id is not None:
                 self._remove_tile(loser_id)
 
-            row, col = event["at"]
+            row, col = event.at
             cell_rect = self._get_cell_rect(row, col)
 
-            new_value = event.get("value", tile_winner.value * 2)
+            new_value = event.value
             tile_winner.switch_tile_value(new_value)
 
             self.id_to_pos[new_id] = (row, col)
 
+            if new_id in animated:
+                continue
+            animated.add(new_id)
+
             dw = round(cell_rect.width() * 0.03)
             dh = round(cell_rect.height() * 0.03)
             start_rect = cell_rect.adjusted(-dw, -dh, dw, dh)
@@ -343,11 +440,8 @@ class GameBoard(QWidget):
             return
 
         for event in step.spawn_events:
-            tile_id = event.get("id", None)
-            if tile_id is None:
-                 continue
-            
-            row, col = event["at"]
+            tile_id = event.tile_id
+            row, col = event.at
             value = step.final_board[row][col]
 
             tile = self.tile_by_id.get(tile_id, None)
@@ -389,11 +483,8 @@ class GameBoard(QWidget):
         self.sfx.play_anti_pop()
         
         for event in step.despawn_events:
-            tile_id = event.get("id", None)
-            if tile_id is None:
-                continue
-
-            row, col = event["at"]
+            tile_id = event.tile_id
+            row, col = event.at
             
             tile = self.tile_by_id.get(tile_id, None)
             if tile is None:
@@ -431,10 +522,8 @@ class GameBoard(QWidget):
             return
 
         for event in step.split_tile_events:
-            from_id = event.get("new_id", None)
-            prev_ids = event.get("from_ids", (None, None))
-            if from_id is None or None in prev_ids:
-                continue
+            from_id = event.new_id
+            prev_ids = event.from_ids
 
             tile_parent = self.tile_by_id.get(from_id, None)
             if tile_parent is None:
@@ -443,9 +532,8 @@ class GameBoard(QWidget):
             prev_tile_id1, prev_tile_id2 = prev_ids
             child_id = prev_tile_id1 if prev_tile_id1 != from_id else prev_tile_id2
 
-            row, col = event["at"]
-            value = event.get("value", tile_parent.value)
-            value = value // 2
+            row, col = event.at
+            value = event.value // 2
 
             if child_id is not None:
                 self._add_tile(child_id, value, row, col)
@@ -464,16 +552,13 @@ class GameBoard(QWidget):
         self.sfx.play_short_swipe()
         
         for event in step.reverse_events:
-            tile_id = event.get("id", None)
-            if tile_id is None:
-                continue
-
+            tile_id = event.tile_id
             tile = self.tile_by_id.get(tile_id, None)
             if tile is None:
                 continue
 
-            from_row, from_col = event["from"]
-            to_row, to_col = event["to"]
+            from_row, from_col = event.from_pos
+            to_row, to_col = event.to_pos
 
             start_rect = self._get_cell_rect(from_row, from_col)
             end_rect = self._get_cell_rect(to_row, to_col)
@@ -507,8 +592,9 @@ class GameBoard(QWidget):
 
         self.sfx.play_pop()
 
-        self._play_merges(step, on_all_finished=on_all_finished)
+        # Спавны раньше слияний: в итоговой дельте серии ходов тайл может поглотить другие, появившись по ходу серии
         self._play_spawns(step, on_all_finished=on_all_finished)
+        self._play_merges(step, on_all_finished=on_all_finished)
 
     def _finish_step(self, step: StepState):
         if self.current_step is not step or step.token != self.animation_token:
@@ -565,6 +651,22 @@ class GameBoard(QWidget):
         anim.finished.connect(handle_finished)
         anim.start()
 
+def short_value(value: int) -> str:
+    if value < 10000:
+        return str(value)
+    units = ["", "K", "M", "B", "T", "Q", "Qi"]
+    count = 0
+
+    while value >= 1000 and count < len(units) - 1:
+        value /= 1000.0
+        count += 1
+
+    short_value = f"{value:.1f}"
+    if len(short_value) > 4:
+        short_value = f"{int(value)}"
+
+    return f"{short_value}{units[count]}"
+
 class EmptyTile(QFrame):
     def __init__(self, parent: QWidget | None = None):
         super().__init__(parent)
@@ -585,20 +687,7 @@ class Tile(QWidget):
         self.font_color = font_color_map["dark"] if value <= 4 else font_color_map["light"]
 
     def _short_value(self, value: int) -> str:
-        if value < 10000:
-            return str(value)
-        units = ["", "K", "M", "B", "T", "Q", "Qi"]
-        count = 0
-
-        while value >= 1000 and count < len(units) - 1:
-            value /= 1000.0
-            count += 1
-
-        short_value = f"{value:.1f}"
-        if len(short_value) > 4:
-            short_value = f"{int(value)}"
-
-        return f"{short_value}{units[count]}"
+        return short_value(value)
     
     def switch_tile_value(self, new_value: int):
         self.value = new_value
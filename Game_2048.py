@@ -1,5 +1,7 @@
+import os
+import random
 import sys
-from PySide6.QtCore import Qt, QTimer, QSettings, QRect, QPoint, QSize
+from PySide6.QtCore import Qt, QTimer, QSettings, QRect, QPoint, QSize, QByteArray, QStandardPaths
 from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QSizeGrip
 from PySide6.QtGui import QIcon, QFont, QFontDatabase
 
@@ -9,19 +11,26 @@ from HUD import HUD
 from ControlsPanel import OptionalButton, ControlButton
 from FocusMode import FocusMode
 from controls import Controls
-from engine import GameEngine
+from engine import DeltaBatch, GameEngine, GameState, MoveLog
+from expectimax import FRAME_BUDGET, ExpectimaxSolver
+from tablebase import TablebaseSolver, open_default
 from utils import load_stylesheet, res_path
 from sounds import SoundsEffects
-from save_load import save_game, load_game
+from history import GameHistory
+from journal import GameJournal
+from persistence import PersistenceService
+from sessions import GameSession, SessionCache
+from save_load import load_game
 import resources_rc
 
 class MainWindow(QMainWindow):
-    def __init__(self, settings: QSettings | None = None):
+    def __init__(self, settings: QSettings | None = None, data_dir: str | None = None):
         super().__init__()
         self.setWindowTitle("2048")
         self.setAttribute(Qt.WA_TranslucentBackground, True)
         self.setAttribute(Qt.WA_NoSystemBackground, True)
         self.settings = settings
+        self.store = PersistenceService(settings)
         self.central_wrapper = QWidget(self)
         self.central_wrapper.setAttribute(Qt.WA_StyledBackground, True)
         self.central_wrapper.setObjectName("CentralWidget")
@@ -42,13 +51,21 @@ class MainWindow(QMainWindow):
         self.sfx = SoundsEffects()
         self.sfx.prestart()    
 
-        self.board_size = self.settings.value("board_size", 4, type=int) if self.settings else 4
-        self.prev_game = self.settings.value(f"prev_game_{self.board_size}x{self.board_size}", None) if self.settings else None
-        self.volume = self.settings.value("volume", 50, type=int) if self.settings else 50
-        self.best_score = self.settings.value(f"best_score_{self.board_size}x{self.board_size}", 0, type=int) if self.settings else 0
+        self.board_size = self.store.value("board_size", 4, type=int)
+        self.data_dir = data_dir or os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericDataLocation), "Cute_Alpaca_Club", "2048_Game")
+        self.history = GameHistory(os.path.join(self.data_dir, "history.sqlite3"))
+        self.volume = self.store.value("volume", 50, type=int)
+        self.best_score = self.store.value(f"best_score_{self.board_size}x{self.board_size}", 0, type=int)
         self.sfx.set_volume(self.volume / 100.0)
 
-        self.engine = GameEngine(self.board_size)
+        self.sessions = SessionCache(on_evict=self._close_session)
+        self.engine: GameEngine | None = None
+        self.journal: GameJournal | None = None
+        self.solver: ExpectimaxSolver | TablebaseSolver | None = None
+
+        self.autoplay_timer = QTimer(self)
+        self.autoplay_timer.setInterval(150)
+        self.autoplay_timer.timeout.connect(self._autoplay_step)
 
         self.focus_mode = FocusMode(self)
 
@@ -57,7 +74,7 @@ class MainWindow(QMainWindow):
 
         self.board_holder = None
         self.game_board = None
-        self._add_board_holder()
+        self.prev_game = self._open_session()
 
         self.hud = None
         self._add_hud()        
@@ -87,7 +104,12 @@ class MainWindow(QMainWindow):
         self.controls.restart.connect(self.on_restart_command)
         self.controls.menu.connect(self.on_menu_command)
         self.controls.undo.connect(self.on_undo_command)
+        self.controls.redo.connect(self.on_redo_command)
+        self.controls.seek_start.connect(lambda: self.on_seek_command(0))
+        self.controls.seek_end.connect(lambda: self.on_seek_command(len(self.engine.log)))
         self.controls.fullscreen.connect(self.on_fullscreen_command)        
+        self.controls.hint.connect(self.on_hint_command)
+        self.controls.autoplay.connect(self.on_autoplay_command)
 
     def _add_board_holder(self):
         self.board_holder = BoardHolder(self, size=self.board_size, sfx=self.sfx)
@@ -96,6 +118,7 @@ class MainWindow(QMainWindow):
         self._arrow_button_command(self.board_holder.down_button, "d")
         self._arrow_button_command(self.board_holder.left_button, "l")
         self._arrow_button_command(self.board_holder.right_button, "r")
+        self._update_arrow_buttons()
         self.board_holder.show()
 
     def _arrow_button_command(self, button: ControlButton, direction: str):
@@ -107,10 +130,23 @@ class MainWindow(QMainWindow):
         y = round(self.height() * 0.15)
         self.board_holder.setGeometry(0, y, w, h)
 
-    def _clear_board_holder(self):
-        self.board_holder.setParent(None)
-        self.board_holder.deleteLater()
-        self.board_holder = None
+    def _open_session(self) -> tuple[GameState, MoveLog] | bytes | dict | None:
+        # Новая сессия текущего размера доски: движок, журнал и виджеты. Возвращает сохраненную партию - из журнала или,
+        # если журнала еще нет, из QSettings (до журнала партия сохранялась туда при закрытии)
+        self.journal = GameJournal(self.data_dir, self.board_size)
+        recovered = self.journal.recover()
+        self.engine = GameEngine(self.board_size, random_seed=random.getrandbits(32)) # сид записывается в историю партий
+        self._add_board_holder()
+        self.sessions.put(self.board_size, GameSession(self.engine, self.journal, self.board_holder))
+        if recovered is None:
+            return self.store.value(f"prev_game_{self.board_size}x{self.board_size}", None)
+        return recovered
+
+    def _close_session(self, session: GameSession):
+        # Вытесненная из кэша сессия: журнал уже содержит партию, виджеты удаляются
+        session.journal.close()
+        session.board_holder.setParent(None)
+        session.board_holder.deleteLater()
 
     def _add_hud(self):
         self.hud = HUD(self, settings=self.settings)
@@ -146,45 +182,59 @@ class MainWindow(QMainWindow):
         self.game_over_overlay.game_over_content.buttons[1].clicked.connect(self.close)
 
     def on_move_command(self, direction: str):
+        self._clear_hint()
         if self.game_board.is_animating():
             self.game_board.snap_current_step()
 
         new_state, moved, delta = self.engine.move(direction)
 
         if moved:
-            def on_animation_complete():
-                self._game_area_rect_in_window()
-
-                if self.engine.state.game_over and not self.game_over_shown:
-                    self.game_over_shown = True
-                    self.game_over_overlay.show_menu([self.game_area_rect, self.hud.geometry(), self.optional_button.geometry()])
-                    self.controls.disable_all_shortcuts()
-
-                if self.engine.state.game_won and not self.game_won_shown:
-                    self.game_won_shown = True
-                    self.game_won_overlay.show_menu([self.game_area_rect, self.hud.geometry(), self.optional_button.geometry()])
-                    self.controls.disable_all_shortcuts()
-
-            animated = True
-            self.game_board.play_step(
-                delta=delta,
-                new_board=new_state.board,
-                new_id_board=new_state.id_board,
-                animated=animated,
-                on_complete=on_animation_complete,
-                variant="move"
-            )
+            self._sync_journal()
+            self._play_forward_step(new_state, delta)
 
         score = self.engine.state.score
         if score > self.best_score:
             self.best_score = score
-            self.settings.setValue(f"best_score_{self.board_size}x{self.board_size}", self.best_score)
+            self.store.set(f"best_score_{self.board_size}x{self.board_size}", self.best_score)
         self.hud.update_score(self.engine.state.score, best_score=self.best_score)
 
+    def _play_forward_step(self, new_state: GameState, delta: DeltaBatch):
+        if new_state.game_over:
+            self.history.finish(self.engine)
+
+        def on_animation_complete():
+            self._game_area_rect_in_window()
+
+            if self.engine.state.game_over and not self.game_over_shown:
+                self.game_over_shown = True
+                self.game_over_overlay.show_menu([self.game_area_rect, self.hud.geometry(), self.optional_button.geometry()])
+                self.controls.disable_all_shortcuts()
+
+            if self.engine.state.game_won and not self.game_won_shown:
+                self.game_won_shown = True
+                self.game_won_overlay.show_menu([self.game_area_rect, self.hud.geometry(), self.optional_button.geometry()])
+                self.controls.disable_all_shortcuts()
+
+        animated = True
+        self.game_board.play_step(
+            delta=delta,
+            new_board=new_state.board,
+            new_id_board=new_state.id_board,
+            animated=animated,
+            on_complete=on_animation_complete,
+            variant="move"
+        )
+        self._update_arrow_buttons()
+
     def on_restart_command(self):   
+        self._clear_hint()
         self.game_won_shown = False
         self.game_over_shown = False     
-        self.engine.new_game(self.engine.size if self.engine.size else self.board_size)
+        if not self.engine.state.game_over: # законченная партия записана в _play_forward_step, в том числе до перезапуска программы
+            self.history.finish(self.engine, abandoned=True)
+        self._new_game(self.engine.size if self.engine.size else self.board_size)
+        self.history.track(self.engine.log)
+        self._sync_journal()
         self._sync_full_redraw()
 
         self.hud.update_score(self.engine.state.score, best_score=self.best_score)
@@ -220,6 +270,7 @@ class MainWindow(QMainWindow):
             self.showFullScreen()
 
     def on_undo_command(self):
+        self._clear_hint()
         if self.game_over_shown or self.game_won_shown:
             self.game_won_shown = False
             self.game_over_shown = False 
@@ -229,6 +280,7 @@ class MainWindow(QMainWindow):
         prev_state, undone, delta = self.engine.undo()
 
         if undone:
+            self._sync_journal()
             animated = True
             self.game_board.play_step(
                 delta=delta,
@@ -237,30 +289,132 @@ class MainWindow(QMainWindow):
                 animated=animated,
                 variant="undo"
             )
+            self._update_arrow_buttons()
 
         self.hud.update_score(prev_state.score, best_score=self.best_score)
 
+    def on_redo_command(self):
+        self._clear_hint()
+        if self.game_board.is_animating():
+            self.game_board.snap_current_step()
+
+        new_state, redone, delta = self.engine.redo()
+
+        if redone:
+            self._sync_journal()
+            self._play_forward_step(new_state, delta)
+
+        self.hud.update_score(new_state.score, best_score=self.best_score)
+
+    def on_seek_command(self, move_index: int):
+        # Соседний ход анимируется как redo/undo, дальний переход перерисовывает доску целиком
+        self._clear_hint()
+        position = self.engine.log.position
+        if move_index < position and (self.game_over_shown or self.game_won_shown):
+            self.game_won_shown = False
+            self.game_over_shown = False
+        if self.game_board.is_animating():
+            self.game_board.snap_current_step()
+
+        new_state, moved, delta = self.engine.seek(move_index)
+
+        if moved:
+            self._sync_journal()
+            if move_index > position:
+                self._play_forward_step(new_state, delta)
+            else:
+                animated = True
+                self.game_board.play_step(
+                    delta=delta,
+                    new_board=new_state.board,
+                    new_id_board=new_state.id_board,
+                    animated=animated,
+                    variant="undo"
+                )
+                self._update_arrow_buttons()
+
+        self.hud.update_score(new_state.score, best_score=self.best_score)
+
+    def on_hint_command(self):
+        direction = self._get_solver().best_move(self.engine.state)
+        self._clear_hint()
+        if direction is not None:
+            self._arrow_button(direction).set_hinted(True)
+
+    def on_autoplay_command(self):
+        if self.autoplay_timer.isActive():
+            self.autoplay_timer.stop()
+        else:
+            self.autoplay_timer.start()
+
+    def _autoplay_step(self):
+        if not self.controls.all_shortcuts_enabled or self.engine.state.game_over:
+            self.autoplay_timer.stop()
+            return
+        if self.game_board.is_animating():
+            return
+        direction = self._get_solver().best_move(self.engine.state)
+        if direction is None:
+            self.autoplay_timer.stop()
+            return
+        self.on_move_command(direction)
+
+    def _get_solver(self) -> ExpectimaxSolver | TablebaseSolver:
+        if self.solver is None or self.solver.size != self.engine.size:
+            solver = ExpectimaxSolver(self.engine.size, time_budget=FRAME_BUDGET) # поиск в потоке интерфейса: глубина по времени
+            tablebase = open_default(self.engine.size) # готовая таблица точной игры, если ее сгенерировали
+            self.solver = TablebaseSolver(tablebase, solver) if tablebase is not None else solver
+        return self.solver
+
+    def _arrow_button(self, direction: str) -> ControlButton:
+        return {
+            "u": self.board_holder.up_button,
+            "d": self.board_holder.down_button,
+            "l": self.board_holder.left_button,
+            "r": self.board_holder.right_button,
+        }[direction]
+
+    def _update_arrow_buttons(self):
+        # Предпросмотр всех ходов: недопустимые стрелки гаснут, а следующий ход берется из готового результата
+        previews = self.engine.preview_all()
+        for direction, preview in previews.items():
+            self._arrow_button(direction).setEnabled(preview.moved)
+
+    def _clear_hint(self):
+        if self.board_holder:
+            for direction in "udlr":
+                self._arrow_button(direction).set_hinted(False)
+
     def change_board_size(self, delta: int = 0):
-        prev_game = save_game(self.engine.state, self.engine.history, self.engine.delta_history)
-        self.settings.setValue(f"prev_game_{self.board_size}x{self.board_size}", prev_game)
         new_size = self.menu_overlay.menu_content.change_size_button.change_value(delta)
-        new_game = self.settings.value(f"prev_game_{new_size}x{new_size}", None)
         if new_size != self.board_size:
             self.board_size = new_size
-            self.settings.setValue("board_size", self.board_size)
-            self.engine.new_game(self.board_size)
-            self._clear_board_holder()
-            self._add_board_holder()
+            self.store.set("board_size", self.board_size)
+            if self.game_board.is_animating():
+                self.game_board.snap_current_step()
+            self.board_holder.hide()
+
+            session = self.sessions.get(self.board_size)
+            if session is None:
+                new_game = self._open_session()
+            else: # размер уже открывался: его партия и доска живы в кэше
+                self.engine, self.journal, self.board_holder = session
+                self.game_board = self.board_holder.game_board
+                self.board_holder.show()
+                self._update_arrow_buttons()
             self._update_board_holder_geometry()
-            self.best_score = self.settings.value(f"best_score_{self.board_size}x{self.board_size}", 0, type=int)
+            self.best_score = self.store.value(f"best_score_{self.board_size}x{self.board_size}", 0, type=int)
             self.hud.update_score(self.engine.state.score, best_score=self.best_score)
-            QTimer.singleShot(0, lambda: (self.load_game(new_game), self.menu_overlay.restart_menu()))
+            if session is None:
+                QTimer.singleShot(0, lambda: (self.load_game(new_game), self.menu_overlay.restart_menu()))
+            else:
+                QTimer.singleShot(0, self.menu_overlay.restart_menu)
 
     def change_volume(self, delta: int = 0):
         new_volume = self.menu_overlay.menu_content.change_volume_button.change_value(delta)
         if new_volume != self.volume:
             self.volume = new_volume
-            self.settings.setValue("volume", self.volume)
+            self.store.set("volume", self.volume)
             self.sfx.set_volume(self.volume / 100.0)
             self.sfx.play_pop()
 
@@ -268,6 +422,7 @@ class MainWindow(QMainWindow):
         state = self.engine.state
         self.game_board.clear_tiles()
         self.game_board.set_full_state(state.board, state.id_board)
+        self._update_arrow_buttons()
 
     def _game_area_rect_in_window(self):
         local = self.board_holder.current_game_area
@@ -363,28 +518,43 @@ class MainWindow(QMainWindow):
             
         super().mouseReleaseEvent(event)
 
-    def load_game(self, prev_game: dict | None):
+    def load_game(self, prev_game: tuple[GameState, MoveLog] | bytes | dict | None):
+        if isinstance(prev_game, QByteArray): # некоторые бэкенды QSettings возвращают bytes как QByteArray
+            prev_game = prev_game.data()
         if prev_game:
             try:
-                state, history, delta_history = load_game(prev_game)
-                self.engine.state = state
-                self.engine.history = history
-                self.engine.delta_history = delta_history
+                state, log = prev_game if isinstance(prev_game, tuple) else load_game(prev_game)
+                self.engine.set_state(state, log)
+                self.engine.random_seed = None # продолженная партия началась не с этого сида
                 self._sync_full_redraw()
                 self.hud.update_score(self.engine.state.score, best_score=self.best_score)
             except (KeyError, ValueError, TypeError, IndexError) as e:
                 print(f"Failed to load saved game: {e}. Starting new game.")
-                self.engine.new_game(self.board_size)
+                self._new_game(self.board_size)
                 self._sync_full_redraw()
                 self.hud.update_score(self.engine.state.score, best_score=self.best_score)
         else:
             self._sync_full_redraw()
+        self.history.track(self.engine.log)
+        self._sync_journal()
+
+    def _new_game(self, size: int):
+        # Каждая партия - со своим сидом: new_game заново создает rng из engine.random_seed
+        self.engine.random_seed = random.getrandbits(32)
+        self.engine.new_game(size)
+
+    def _sync_journal(self):
+        # Дописывает в журнал изменения после команды: несколько байт на ход, без записи всей партии
+        try:
+            self.journal.sync(self.engine.state, self.engine.log)
+        except OSError as e:
+            print(f"Failed to save game progress: {e}")
 
     def closeEvent(self, event):
-        prev_game = save_game(self.engine.state, self.engine.history, self.engine.delta_history)
-        self.settings.setValue(f"prev_game_{self.board_size}x{self.board_size}", prev_game)
-        self.settings.setValue("board_size", self.board_size)
-        self.settings.setValue("volume", self.volume)
+        for session in self.sessions:
+            session.journal.close()
+        self.store.close() # сбрасывает отложенные записи настроек
+        self.history.close()
         return super().closeEvent(event)
     
     def _window_resize(self):
@@ -2,6 +2,7 @@ from PySide6.QtCore import Qt, QRect, QEvent, Signal, QTimer
 from PySide6.QtGui import QPainter, QPixmap, QShortcut, QKeySequence, QFont
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton
 
+from engine import MAX_BOARD_SIZE
 from sounds import SoundsEffects
 
 class MenuOverlay(QWidget):
@@ -305,7 +306,7 @@ class MenuContent(QWidget):
 
         self.change_size_button = MenuSpinButton(self, board_size, delta=1)
         self.change_size_button.set_name_text("Board\u2009Size:")
-        self.change_size_button.set_range(3, 8)
+        self.change_size_button.set_range(3, MAX_BOARD_SIZE)
         self.change_size_button.set_value_format("{value}x{value}")
 
         self.change_volume_button = MenuSpinButton(self, volume, delta=10)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+from typing import List, Sequence, Tuple
+
+from array import array
+import random
+
+import numpy as np
+
+from engine import GameState
+
+DIRECTIONS = "udlr"
+WIN_EXPONENT = 11 # 2048
+
+class BatchGameEngine:
+    # K досок одного размера в одном массиве (K, n, n) показателей степени двойки.
+    # Генератор случайных чисел у каждой доски свой, поэтому при тех же сидах партии совпадают с GameEngine.
+    def __init__(self, size: int, random_seeds: Sequence[int | None]):
+        self.size = size
+        self.count = len(random_seeds)
+        self.random_seeds = list(random_seeds)
+        self.rngs: List[random.Random] = []
+        self.boards = np.zeros((self.count, size, size), dtype=np.int8)
+        self.scores = np.zeros(self.count, dtype=np.int64)
+        self.game_over = np.zeros(self.count, dtype=bool)
+        self.game_won = np.zeros(self.count, dtype=bool)
+        self.new_game()
+
+    def new_game(self):
+        self.rngs = [random.Random(seed) for seed in self.random_seeds]
+        self.boards[:] = 0
+        self.scores[:] = 0
+        self.game_over[:] = False
+        self.game_won[:] = False
+
+        everyone = np.ones(self.count, dtype=bool)
+        self._spawn(everyone)
+        self._spawn(everyone)
+
+    def move(self, directions: str | Sequence[str] | np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        codes = self._direction_codes(directions)
+        new_boards, score_gain, moved = slide(self.boards, codes)
+
+        self.boards[moved] = new_boards[moved]
+        self.scores += score_gain
+        self.game_won |= moved & (self.boards == WIN_EXPONENT).reshape(self.count, -1).any(axis=1)
+
+        self._spawn(moved)
+        self.game_over = game_over_mask(self.boards)
+        return moved, score_gain
+
+    def values(self) -> np.ndarray:
+        return np.where(self.boards > 0, np.left_shift(1, self.boards.astype(np.int64)), 0)
+
+    def state(self, index: int) -> GameState:
+        # Доски пакета уже хранят показатели степени, как GameState.cells
+        return GameState(
+            self.size,
+            self.boards[index].astype(np.uint8).tobytes(),
+            array("I", bytes(4 * self.size * self.size)), # id тайлов в пакетном движке не отслеживаются
+            score=int(self.scores[index]),
+            game_over=bool(self.game_over[index]),
+            game_won=bool(self.game_won[index]),
+        )
+
+    def _direction_codes(self, directions: str | Sequence[str] | np.ndarray) -> np.ndarray:
+        if isinstance(directions, str) and len(directions) == 1:
+            return np.full(self.count, DIRECTIONS.index(directions), dtype=np.int8)
+        if isinstance(directions, np.ndarray) and directions.dtype.kind in "iu":
+            codes = directions.astype(np.int8)
+        else:
+            codes = np.array([DIRECTIONS.index(d) for d in directions], dtype=np.int8)
+        if codes.shape != (self.count,):
+            raise ValueError(f"expected {self.count} directions, got {codes.shape[0]}")
+        return codes
+
+    def _spawn(self, mask: np.ndarray):
+        # Те же вызовы rng, что и в GameEngine._spawn_tile: выбор пустой клетки в порядке обхода строк, затем 2 или 4
+        flat = self.boards.reshape(self.count, -1)
+        empties = flat == 0
+        empty_counts = empties.sum(axis=1)
+
+        picks = np.full(self.count, -1, dtype=np.int64)
+        exponents = np.zeros(self.count, dtype=np.int8)
+        for i in np.flatnonzero(mask & (empty_counts > 0)):
+            rng = self.rngs[i]
+            picks[i] = rng.choice(range(empty_counts[i]))
+            exponents[i] = 1 if rng.random() < 0.9 else 2
+
+        spawned = picks >= 0
+        if not spawned.any():
+            return
+        ranks = np.cumsum(empties, axis=1) - 1
+        cells = np.argmax(empties & (ranks == picks[:, None]), axis=1)
+        rows = np.flatnonzero(spawned)
+        flat[rows, cells[rows]] = exponents[rows]
+
+def slide(boards: np.ndarray, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Все доски приводятся к движению влево, сдвигаются одним проходом по столбцам и возвращаются обратно
+    count, n, _ = boards.shape
+    columns = (codes == 0) | (codes == 1)
+    reverse = (codes == 1) | (codes == 3)
+
+    work = boards.copy()
+    work[columns] = work[columns].transpose(0, 2, 1)
+    work[reverse] = work[reverse][:, :, ::-1]
+
+    lines = work.reshape(count * n, n)
+    lines, line_gain = _slide_left(lines)
+    work = lines.reshape(count, n, n)
+
+    work[reverse] = work[reverse][:, :, ::-1]
+    work[columns] = work[columns].transpose(0, 2, 1)
+
+    score_gain = line_gain.reshape(count, n).sum(axis=1)
+    moved = (work != boards).reshape(count, -1).any(axis=1)
+    return work, score_gain, moved
+
+def _compact(lines: np.ndarray) -> np.ndarray:
+    order = np.argsort(lines == 0, axis=1, kind="stable")
+    return np.take_along_axis(lines, order, axis=1)
+
+def _slide_left(lines: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    lines = _compact(lines)
+    gain = np.zeros(lines.shape[0], dtype=np.int64)
+    for j in range(lines.shape[1] - 1):
+        merge = (lines[:, j] != 0) & (lines[:, j] == lines[:, j + 1])
+        if not merge.any():
+            continue
+        lines[merge, j] += 1
+        lines[merge, j + 1] = 0
+        gain[merge] += np.left_shift(1, lines[merge, j].astype(np.int64))
+    return _compact(lines), gain
+
+def game_over_mask(boards: np.ndarray) -> np.ndarray:
+    count = boards.shape[0]
+    has_empty = (boards == 0).reshape(count, -1).any(axis=1)
+    horizontal = (boards[:, :, 1:] == boards[:, :, :-1]).reshape(count, -1).any(axis=1)
+    vertical = (boards[:, 1:, :] == boards[:, :-1, :]).reshape(count, -1).any(axis=1)
+    return ~(has_empty | horizontal | vertical)
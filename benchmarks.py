@@ -0,0 +1,303 @@
+from __future__ import annotations
+import argparse
+from dataclasses import dataclass, field
+import pickle
+import random
+import sys
+import tempfile
+import time
+
+import bitboard
+import symmetry
+from engine import GameEngine, GameState, line_cache
+from journal import GameJournal
+from save_load import load_game, save_game, save_game_dict
+
+DIRECTIONS = "udlr"
+
+def _timeit(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def _played_engine(size: int, moves: int, seed: int = 0) -> GameEngine:
+    engine = GameEngine(size, random_seed=seed)
+    rng = random.Random(seed)
+    for _ in range(moves):
+        engine.move(rng.choice(DIRECTIONS))
+        if engine.state.game_over:
+            break
+    return engine
+
+def bench_bitboard(repeat: int):
+    engine = _played_engine(4, 60)
+    state = engine.state
+    bits = bitboard.encode_cells(state.cells)
+
+    for direction in DIRECTIONS:
+        list_time = _timeit(lambda: engine._move(state.cells, state.ids, direction), repeat)
+        bits_time = _timeit(lambda: bitboard.move(bits, direction), repeat)
+        print(f"4x4 {direction}: _move {1 / list_time:>10.0f} moves/s | bitboard {1 / bits_time:>10.0f} moves/s | x{list_time / bits_time:.1f}")
+    # Ход движка целиком (спавн, журнал, флаги): без событий 4x4 идет по упакованной доске, с событиями - по cells/ids
+    with_delta = _play_moves(4, repeat, True)
+    without_delta = _play_moves(4, repeat, False)
+    print(f"4x4 GameEngine.move: delta {with_delta:>10.0f} moves/s | record_delta=False {without_delta:>10.0f} moves/s | x{without_delta / with_delta:.1f}")
+
+def bench_play(repeat: int):
+    for size in range(3, 9):
+        rng = random.Random(size)
+        engine = GameEngine(size, random_seed=size)
+        moves = 0
+        start = time.perf_counter()
+        while moves < repeat:
+            _, moved, _ = engine.move(rng.choice(DIRECTIONS))
+            moves += 1
+            if engine.state.game_over:
+                engine.new_game(size)
+        elapsed = time.perf_counter() - start
+        print(f"{size}x{size}: GameEngine.move {moves / elapsed:>10.0f} moves/s")
+
+def _play_moves(size: int, moves: int, record_delta: bool) -> float:
+    # Один и тот же поток ходов и спавнов для обоих режимов: сиды движка и выбора хода фиксированы.
+    # Кэш линий общий для всех движков размера, поэтому каждый прогон начинается с пустого: иначе второй прогон меряет прогретый кэш
+    line_cache(size).clear()
+    rng = random.Random(size)
+    engine = GameEngine(size, random_seed=size)
+    start = time.perf_counter()
+    for _ in range(moves):
+        engine.move(rng.choice(DIRECTIONS), record_delta=record_delta)
+        if engine.state.game_over:
+            engine.new_game(size)
+    return moves / (time.perf_counter() - start)
+
+def bench_delta(repeat: int):
+    for size in range(3, 9):
+        with_delta = _play_moves(size, repeat, True)
+        without_delta = _play_moves(size, repeat, False)
+        engine = _played_engine(size, size * size * 4, seed=size)
+        cells = engine.state.cells
+        simulate_time = _timeit(lambda: engine.simulate_move(cells, "l"), repeat // 4)
+        print(
+            f"{size}x{size}: move {with_delta:>8.0f} moves/s | record_delta=False {without_delta:>8.0f} moves/s "
+            f"x{without_delta / with_delta:.2f} | simulate_move {1 / simulate_time:>8.0f} moves/s"
+        )
+
+@dataclass
+class _ListState:
+    # Прежнее представление GameState: dataclass с двумя матрицами int, для сравнения памяти
+    board: list
+    id_board: list
+    score: int = 0
+    game_over: bool = False
+    game_won: bool = False
+    next_id: int = 1
+    bits: int | None = field(default=None, repr=False, compare=False)
+    empty_mask: int | None = field(default=None, repr=False, compare=False)
+    max_tile: int | None = field(default=None, repr=False, compare=False)
+    row_pairs: int | None = field(default=None, repr=False, compare=False)
+    column_pairs: int | None = field(default=None, repr=False, compare=False)
+
+def _state_bytes(state: GameState) -> int:
+    # Объект состояния, клетки и id; int из кэша малых чисел интерпретатора не считаются
+    return sys.getsizeof(state) + sys.getsizeof(state.cells) + sys.getsizeof(state.ids) + _large_ints_bytes([state.score, state.next_id])
+
+def _list_state_bytes(state: _ListState) -> int:
+    total = sys.getsizeof(state) + sys.getsizeof(state.__dict__)
+    for board in (state.board, state.id_board):
+        total += sys.getsizeof(board) + sum(sys.getsizeof(row) + _large_ints_bytes(row) for row in board)
+    return total + _large_ints_bytes([state.score, state.next_id])
+
+def _large_ints_bytes(values) -> int:
+    return sum(sys.getsizeof(value) for value in values if not -5 <= value <= 256)
+
+def bench_sequence(repeat: int):
+    # Серия из 8 ходов: move() по одному с событиями против apply_moves с одной итоговой дельтой
+    for size in (4, 6, 16):
+        bursts = [''.join(random.Random(i).choice(DIRECTIONS) for _ in range(8)) for i in range(max(1, repeat // 8))]
+        single = GameEngine(size, random_seed=size)
+        start = time.perf_counter()
+        for burst in bursts:
+            for direction in burst:
+                single.move(direction)
+            if single.state.game_over:
+                single.new_game(size)
+        single_time = time.perf_counter() - start
+
+        batched = GameEngine(size, random_seed=size)
+        start = time.perf_counter()
+        for burst in bursts:
+            batched.apply_moves(burst)
+            if batched.state.game_over:
+                batched.new_game(size)
+        batched_time = time.perf_counter() - start
+        print(f"{size}x{size}: move x8 {len(bursts) / single_time:>8.0f} bursts/s | apply_moves {len(bursts) / batched_time:>8.0f} bursts/s | x{single_time / batched_time:.2f}")
+
+def bench_history(repeat: int):
+    # Память на один ход истории: журнал ходов с ключевыми кадрами против хранения состояния после каждого хода
+    moves = 1000
+    for size in range(3, 9):
+        engine = GameEngine(size, random_seed=size)
+        rng = random.Random(size)
+        while len(engine.log) < moves and not engine.state.game_over:
+            engine.move(rng.choice(DIRECTIONS), record_delta=False)
+        log = engine.log
+        played = len(log)
+
+        log_bytes = sys.getsizeof(log.records) + sum(map(_state_bytes, log.keyframes))
+        states = sum(_state_bytes(engine._state_at(i)) for i in range(played + 1))
+        undo_time = _timeit(lambda: engine._state_at(played - 1), 20)
+        print(
+            f"{size}x{size}: {played:>4} moves | log {log_bytes / played:>6.1f} B/move | "
+            f"state per move {states / played:>6.0f} B/move | undo {undo_time * 1000:.2f} ms"
+        )
+
+def bench_save(repeat: int):
+    # Сохранение партии из 300 ходов: двоичный формат против словаря, сериализованного pickle (замена варианта QSettings)
+    for size in (3, 4, 5, 6, 8, 16, 32):
+        engine = GameEngine(size, random_seed=size)
+        rng = random.Random(size)
+        while len(engine.log) < 300 and not engine.state.game_over:
+            engine.move(rng.choice(DIRECTIONS), record_delta=False)
+        state, log = engine.state, engine.log
+        count = max(1, repeat // 200)
+
+        data = save_game(state, log)
+        encode = _timeit(lambda: save_game(state, log), count)
+        decode = _timeit(lambda: load_game(data), count)
+        old = pickle.dumps(save_game_dict(state, log))
+        old_encode = _timeit(lambda: pickle.dumps(save_game_dict(state, log)), count)
+        old_decode = _timeit(lambda: load_game(pickle.loads(old)), count)
+        print(
+            f"{size}x{size}: {len(log):>3} moves | binary {len(data):>6} B, encode {encode * 1e6:>7.0f} us, decode {decode * 1e6:>7.0f} us | "
+            f"dict {len(old):>7} B, encode {old_encode * 1e6:>7.0f} us, decode {old_decode * 1e6:>7.0f} us"
+        )
+
+def bench_journal(repeat: int):
+    # Стоимость сохранения после хода: событие в журнале против полного снимка партии (как раньше при закрытии)
+    for size in (4, 8, 16):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = GameEngine(size, random_seed=size)
+            journal = GameJournal(directory, size)
+            journal.sync(engine.state, engine.log)
+            rng = random.Random(size)
+            moves = 0
+            elapsed = 0.0
+            while moves < repeat // 10 and not engine.state.game_over:
+                _, moved, _ = engine.move(rng.choice(DIRECTIONS), record_delta=False)
+                if moved:
+                    start = time.perf_counter()
+                    journal.sync(engine.state, engine.log)
+                    elapsed += time.perf_counter() - start
+                    moves += 1
+            snapshot = _timeit(lambda: save_game(engine.state, engine.log), max(1, repeat // 200))
+            journal.close()
+        print(f"{size}x{size}: {moves:>5} moves | journal {elapsed / max(moves, 1) * 1e6:>6.1f} us/move, {journal.compactions} compactions | full save {snapshot * 1e6:>7.0f} us")
+
+def bench_state(repeat: int):
+    # Память на одно состояние: плоские bytes/array("I") со __slots__ против dataclass с матрицами int
+    for size in range(3, 9):
+        engine = _played_engine(size, size * size * 4, seed=size)
+        state = engine.state
+        before = _list_state_bytes(_ListState(state.board, state.id_board, state.score, state.game_over, state.game_won, state.next_id))
+        after = _state_bytes(state)
+        hash_time = _timeit(lambda: hash(state), repeat)
+        board = state.board
+        nested_time = _timeit(lambda: hash(tuple(map(tuple, board))), repeat) # ключ, который пришлось бы строить по матрице
+        print(
+            f"{size}x{size}: lists {before:>6} B/state | compact {after:>5} B/state | x{before / after:.1f} smaller | "
+            f"zobrist hash {1 / hash_time:>10.0f}/s | nested tuples {1 / nested_time:>9.0f}/s"
+        )
+
+def bench_symmetry(repeat: int):
+    # Скорость канонизации и сколько записей остается от всех стартовых позиций (два тайла 2/4) после нее
+    for size in range(3, 9):
+        engine = GameEngine(size, random_seed=size)
+        cells_count = size * size
+        positions = set()
+        for first in range(cells_count):
+            for second in range(first + 1, cells_count):
+                for e1 in (1, 2):
+                    for e2 in (1, 2):
+                        board = bytearray(cells_count)
+                        board[first], board[second] = e1, e2
+                        positions.add(bytes(board))
+        canonical = {engine.canonical(cells)[0] for cells in positions}
+
+        cells = _played_engine(size, size * size * 4, seed=size).state.cells
+        canonical_time = _timeit(lambda: engine.canonical(cells), repeat)
+        line = f"{size}x{size}: canonical {1 / canonical_time:>8.0f}/s | openings {len(positions):>5} -> {len(canonical):>5} x{len(positions) / len(canonical):.2f}"
+        if size == 4:
+            bits = bitboard.encode_cells(cells)
+            line += f" | canonical_bits {1 / _timeit(lambda: symmetry.canonical_bits(bits), repeat):>8.0f}/s"
+        print(line)
+
+def bench_line_cache(repeat: int):
+    for size in range(3, 9):
+        cache = line_cache(size)
+        cache.clear()
+        engine = _played_engine(size, size * size * 4, seed=size)
+        state = engine.state
+        move_time = _timeit(lambda: engine._move(state.cells, state.ids, "l"), repeat // 4)
+        stats = cache.stats()
+        print(
+            f"{size}x{size}: _move {1 / move_time:>8.0f} moves/s | "
+            f"entries {stats['entries']:>6} | hits {stats['hits']:>8} | misses {stats['misses']:>6} | hit rate {stats['hit_rate']:.1%}"
+        )
+
+def bench_large(repeat: int):
+    # Задержка хода на больших досках: среднее и худший случай против бюджета кадра (16 мс)
+    for size in (9, 16, 32):
+        rng = random.Random(size)
+        engine = GameEngine(size, random_seed=size)
+        times = []
+        for _ in range(min(repeat, 5000)):
+            start = time.perf_counter()
+            engine.move(rng.choice(DIRECTIONS))
+            times.append(time.perf_counter() - start)
+            if engine.state.game_over:
+                engine.new_game(size)
+        times.sort()
+        mean = sum(times) / len(times)
+        print(f"{size}x{size}: move mean {mean * 1e3:.3f} ms | p99 {times[len(times) * 99 // 100] * 1e3:.3f} ms | max {times[-1] * 1e3:.3f} ms")
+
+def bench_batch(repeat: int):
+    from batch_engine import BatchGameEngine # numpy нужен только этому замеру
+
+    boards = 4096
+    steps = max(1, repeat // boards)
+    for size in range(3, 9):
+        batch = BatchGameEngine(size, random_seeds=range(boards))
+        rng = random.Random(size)
+        start = time.perf_counter()
+        for _ in range(steps):
+            batch.move("".join(rng.choice(DIRECTIONS) for _ in range(boards)))
+        elapsed = time.perf_counter() - start
+        print(f"{size}x{size}: BatchGameEngine x{boards} {steps * boards / elapsed:>10.0f} moves/s")
+
+BENCHMARKS = {
+    "bitboard": bench_bitboard,
+    "play": bench_play,
+    "delta": bench_delta,
+    "sequence": bench_sequence,
+    "history": bench_history,
+    "save": bench_save,
+    "journal": bench_journal,
+    "state": bench_state,
+    "symmetry": bench_symmetry,
+    "linecache": bench_line_cache,
+    "large": bench_large,
+    "batch": bench_batch,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="2048 engine benchmarks")
+    parser.add_argument("names", nargs="*", metavar="name", help=f"one of: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    for name in args.names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+        print(f"== {name} ==")
+        BENCHMARKS[name](args.repeat)
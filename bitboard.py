@@ -0,0 +1,195 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+
+import itertools
+
+# Упакованная доска 4x4: 64-битное число, по 4 бита (показатель степени двойки) на клетку.
+# Клетка (r, c) хранится в битах 4 * (4 * r + c), строка r - в битах 16 * r ... 16 * r + 15.
+
+ROW_MASK = 0xFFFF
+NIBBLE_MASK = 0x1111111111111111
+MAX_EXPONENT = 14 # 15 + 15 уже не помещается в 4 бита, поэтому 32768 на доске выключает быстрый путь
+
+ROW_LEFT: List[int] = []
+ROW_RIGHT: List[int] = []
+COL_UP: List[int] = []
+COL_DOWN: List[int] = []
+SCORE_LEFT: List[int] = []
+SCORE_RIGHT: List[int] = []
+
+LineTemplate = Tuple[Tuple[int, int, int], ...] # (откуда, второй тайл слияния или -1, куда)
+
+_templates: Dict[Tuple[int, bool], LineTemplate] = {}
+
+def _unpack_row(row: int) -> List[int]:
+    return [(row >> (4 * i)) & 0xF for i in range(4)]
+
+def _reverse_row(row: int) -> int:
+    return ((row & 0xF) << 12) | ((row & 0xF0) << 4) | ((row >> 4) & 0xF0) | (row >> 12)
+
+def _spread_col(row: int) -> int: # строка из 4 клеток -> столбец 0 доски
+    return (row & 0xF) | ((row & 0xF0) << 12) | ((row & 0xF00) << 24) | ((row & 0xF000) << 36)
+
+def _build_tables():
+    left = [0] * 65536
+    score = [0] * 65536
+    row = 0
+    for d, c, b, a in itertools.product(range(16), repeat=4): # перебор в порядке возрастания номера строки
+        tiles = [e for e in (a, b, c, d) if e]
+        count = len(tiles)
+        packed = 0
+        shift = 0
+        gain = 0
+        i = 0
+        while i < count:
+            e = tiles[i]
+            if i + 1 < count and e == tiles[i + 1]:
+                gain += 1 << (e + 1)
+                e = min(e + 1, 15)
+                i += 2
+            else:
+                i += 1
+            packed |= e << shift
+            shift += 4
+        left[row] = packed
+        score[row] = gain
+        row += 1
+
+    reverse = [_reverse_row(r) for r in range(65536)]
+    right = [reverse[left[reverse[r]]] for r in range(65536)]
+
+    ROW_LEFT[:] = left
+    ROW_RIGHT[:] = right
+    SCORE_LEFT[:] = score
+    SCORE_RIGHT[:] = [score[reverse[r]] for r in range(65536)]
+    COL_UP[:] = [_spread_col(r) for r in left]
+    COL_DOWN[:] = [_spread_col(r) for r in right]
+
+_build_tables()
+
+_NIBBLE_PAIRS = [bytes((byte & 0xF, byte >> 4)) for byte in range(256)] # байт упакованной доски -> две клетки
+
+def encode_cells(cells: bytes) -> Optional[int]:
+    # Плоская доска показателей GameState.cells -> 64-битное число: байты сжимаются в тетрады попарно
+    if len(cells) != 16 or max(cells) > MAX_EXPONENT:
+        return None
+    bits = int.from_bytes(cells, "little")
+    bits = (bits | bits >> 4) & 0x00FF00FF00FF00FF00FF00FF00FF00FF
+    bits = (bits | bits >> 8) & 0x0000FFFF0000FFFF0000FFFF0000FFFF
+    bits = (bits | bits >> 16) & 0x00000000FFFFFFFF00000000FFFFFFFF
+    return (bits | bits >> 32) & 0xFFFFFFFFFFFFFFFF
+
+def decode_cells(bits: int) -> bytes:
+    return b"".join(map(_NIBBLE_PAIRS.__getitem__, bits.to_bytes(8, "little")))
+
+def is_safe(bits: int) -> bool:
+    return not (bits & (bits >> 1) & (bits >> 2) & (bits >> 3) & NIBBLE_MASK)
+
+def transpose(bits: int) -> int:
+    a1 = bits & 0xF0F00F0FF0F00F0F
+    a2 = bits & 0x0000F0F00000F0F0
+    a3 = bits & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+def move(bits: int, direction: str) -> Tuple[int, int]:
+    if direction == "l":
+        r0, r1, r2, r3 = bits & ROW_MASK, (bits >> 16) & ROW_MASK, (bits >> 32) & ROW_MASK, bits >> 48
+        return (
+            ROW_LEFT[r0] | (ROW_LEFT[r1] << 16) | (ROW_LEFT[r2] << 32) | (ROW_LEFT[r3] << 48),
+            SCORE_LEFT[r0] + SCORE_LEFT[r1] + SCORE_LEFT[r2] + SCORE_LEFT[r3],
+        )
+    if direction == "r":
+        r0, r1, r2, r3 = bits & ROW_MASK, (bits >> 16) & ROW_MASK, (bits >> 32) & ROW_MASK, bits >> 48
+        return (
+            ROW_RIGHT[r0] | (ROW_RIGHT[r1] << 16) | (ROW_RIGHT[r2] << 32) | (ROW_RIGHT[r3] << 48),
+            SCORE_RIGHT[r0] + SCORE_RIGHT[r1] + SCORE_RIGHT[r2] + SCORE_RIGHT[r3],
+        )
+    t = transpose(bits)
+    c0, c1, c2, c3 = t & ROW_MASK, (t >> 16) & ROW_MASK, (t >> 32) & ROW_MASK, t >> 48
+    if direction == "u":
+        return (
+            COL_UP[c0] | (COL_UP[c1] << 4) | (COL_UP[c2] << 8) | (COL_UP[c3] << 12),
+            SCORE_LEFT[c0] + SCORE_LEFT[c1] + SCORE_LEFT[c2] + SCORE_LEFT[c3],
+        )
+    return (
+        COL_DOWN[c0] | (COL_DOWN[c1] << 4) | (COL_DOWN[c2] << 8) | (COL_DOWN[c3] << 12),
+        SCORE_RIGHT[c0] + SCORE_RIGHT[c1] + SCORE_RIGHT[c2] + SCORE_RIGHT[c3],
+    )
+
+def move_all(bits: int) -> Tuple[Tuple[int, int], Tuple[int, int], Tuple[int, int], Tuple[int, int]]:
+    # Ходы u, d, l, r за один проход: строки и транспонированная доска извлекаются один раз
+    r0, r1, r2, r3 = bits & ROW_MASK, (bits >> 16) & ROW_MASK, (bits >> 32) & ROW_MASK, bits >> 48
+    t = transpose(bits)
+    c0, c1, c2, c3 = t & ROW_MASK, (t >> 16) & ROW_MASK, (t >> 32) & ROW_MASK, t >> 48
+    return (
+        (
+            COL_UP[c0] | (COL_UP[c1] << 4) | (COL_UP[c2] << 8) | (COL_UP[c3] << 12),
+            SCORE_LEFT[c0] + SCORE_LEFT[c1] + SCORE_LEFT[c2] + SCORE_LEFT[c3],
+        ),
+        (
+            COL_DOWN[c0] | (COL_DOWN[c1] << 4) | (COL_DOWN[c2] << 8) | (COL_DOWN[c3] << 12),
+            SCORE_RIGHT[c0] + SCORE_RIGHT[c1] + SCORE_RIGHT[c2] + SCORE_RIGHT[c3],
+        ),
+        (
+            ROW_LEFT[r0] | (ROW_LEFT[r1] << 16) | (ROW_LEFT[r2] << 32) | (ROW_LEFT[r3] << 48),
+            SCORE_LEFT[r0] + SCORE_LEFT[r1] + SCORE_LEFT[r2] + SCORE_LEFT[r3],
+        ),
+        (
+            ROW_RIGHT[r0] | (ROW_RIGHT[r1] << 16) | (ROW_RIGHT[r2] << 32) | (ROW_RIGHT[r3] << 48),
+            SCORE_RIGHT[r0] + SCORE_RIGHT[r1] + SCORE_RIGHT[r2] + SCORE_RIGHT[r3],
+        ),
+    )
+
+def lines(bits: int, direction: str) -> Tuple[int, int, int, int]:
+    if direction in ("d", "u"):
+        bits = transpose(bits)
+    return bits & ROW_MASK, (bits >> 16) & ROW_MASK, (bits >> 32) & ROW_MASK, bits >> 48
+
+def line_template(line: int, reverse: bool) -> LineTemplate:
+    key = (line, reverse)
+    template = _templates.get(key)
+    if template is not None:
+        return template
+
+    cells = _unpack_row(line)
+    order = [3, 2, 1, 0] if reverse else [0, 1, 2, 3]
+    tiles = [(cells[idx], idx) for idx in order if cells[idx]]
+    entries = []
+    write = 0
+    i = 0
+    while i < len(tiles):
+        if i + 1 < len(tiles) and tiles[i][0] == tiles[i + 1][0]:
+            entries.append((tiles[i][1], tiles[i + 1][1], order[write]))
+            i += 2
+        else:
+            entries.append((tiles[i][1], -1, order[write]))
+            i += 1
+        write += 1
+    template = tuple(entries)
+    _templates[key] = template
+    return template
+
+def occupied_mask(bits: int) -> int:
+    # 16-битная маска занятых клеток: бит 4*r + c, тот же порядок, что у пустых клеток в GameState.empty_mask
+    bits |= bits >> 2
+    bits |= bits >> 1
+    bits &= NIBBLE_MASK # младший бит каждой тетрады - клетка занята
+    bits |= bits >> 3
+    bits |= bits >> 6
+    return (bits & 0xF) | ((bits >> 12) & 0xF0) | ((bits >> 24) & 0xF00) | ((bits >> 36) & 0xF000)
+
+def pair_counts(bits: int) -> Tuple[int, int]:
+    # Пары соседних одинаковых непустых тайлов: (в строках, в столбцах)
+    occupied = bits | (bits >> 2)
+    occupied |= occupied >> 1
+    counts = []
+    for shift, edge in ((4, 0x0111011101110111), (16, 0x0000111111111111)): # последний столбец / строка не имеет соседа
+        equal = bits ^ (bits >> shift)
+        equal |= equal >> 2
+        equal |= equal >> 1
+        counts.append((~equal & occupied & edge).bit_count())
+    return counts[0], counts[1]
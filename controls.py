@@ -10,9 +10,14 @@ RIGHT = 'r' # R / → / num6 / slide right
 class Controls(QObject):
     move = Signal(str) # 'u', 'd', 'l', 'r'
     undo = Signal() # ctrl + z
+    redo = Signal() # ctrl + y / ctrl + shift + z
+    seek_start = Signal() # Home
+    seek_end = Signal() # End
     restart = Signal() # ctrl + n
     menu = Signal() # Escape
     fullscreen = Signal() # F11 / alt + Enter
+    hint = Signal() # H
+    autoplay = Signal() # P
 
     def __init__(self, parent: QWidget):
         super().__init__(parent)
@@ -48,15 +53,46 @@ class Controls(QObject):
         shortcut = QShortcut(QKeySequence("Ctrl+Z"), self.parentt, activated=lambda: self._emit_undo())
         self.all_shortcuts.append(shortcut)
 
+        for seq in ("Ctrl+Y", "Ctrl+Shift+Z"):
+            shortcut = QShortcut(QKeySequence(seq), self.parentt, activated=lambda: self._emit_redo())
+            self.all_shortcuts.append(shortcut)
+
+        shortcut = QShortcut(QKeySequence("Home"), self.parentt, activated=lambda: self._emit_seek_start())
+        self.all_shortcuts.append(shortcut)
+
+        shortcut = QShortcut(QKeySequence("End"), self.parentt, activated=lambda: self._emit_seek_end())
+        self.all_shortcuts.append(shortcut)
+
+        shortcut = QShortcut(QKeySequence("H"), self.parentt, activated=lambda: self._emit_hint())
+        self.all_shortcuts.append(shortcut)
+
+        shortcut = QShortcut(QKeySequence("P"), self.parentt, activated=lambda: self._emit_autoplay())
+        self.all_shortcuts.append(shortcut)
+
     def _emit_move(self, direction: str):
         self.move.emit(direction)
 
     def _emit_undo(self):
         self.undo.emit()
 
+    def _emit_redo(self):
+        self.redo.emit()
+
+    def _emit_seek_start(self):
+        self.seek_start.emit()
+
+    def _emit_seek_end(self):
+        self.seek_end.emit()
+
     def _emit_restart(self):
         self.restart.emit()
 
+    def _emit_hint(self):
+        self.hint.emit()
+
+    def _emit_autoplay(self):
+        self.autoplay.emit()
+
     def _emit_menu(self):
         self.menu.emit()
 
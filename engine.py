@@ -1,290 +1,1085 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple, Optional
 
-from dataclasses import dataclass, replace
+from array import array
+from collections import OrderedDict
+from operator import eq
 import random
 
-DeltaEvent = Dict[str, Any]
+import bitboard
+from symmetry import SymmetryTables, symmetry_tables
+
+LineTemplate = Tuple[Tuple[int, int, int], ...] # (откуда, второй тайл слияния или -1, куда) - индексы внутри линии
+
+KEYFRAME_INTERVAL = 32 # полное состояние в журнале ходов сохраняется раз в столько ходов
+ORIGIN_CHAIN_LIMIT = KEYFRAME_INTERVAL # состояний 4x4 без ids (GameState.origin) подряд, после которых ids собираются сразу
+ZOBRIST_SEED = 2048 # ключи Zobrist фиксированы, чтобы хеши позиций совпадали между процессами и запусками
+# Записей в каждой из двух таблиц LineCache (сдвиг к началу и к концу линии), запись - около 500 байт на 3x3 и 700 на 8x8:
+# не больше ~25 МБ на таблицу. Линии, встречающиеся в партиях, повторяются, и LRU такого размера почти не промахивается
+LINE_CACHE_LIMITS = {3: 50_000, 4: 50_000, 5: 50_000, 6: 40_000, 7: 30_000, 8: 25_000}
+LARGE_LINE_CACHE_LIMIT = 20_000 # доски больше 8x8: длинные линии почти не повторяются, а запись занимает килобайты
+MAX_BOARD_SIZE = 32 # клетка спавна в журнале ходов занимает 12 бит
+
+class TemplateChanges(NamedTuple):
+    changed: int # маска клеток линии, содержимое которых меняется
+    cells: Tuple[int, ...] # те же клетки по порядку
+    template: LineTemplate # только записи шаблона, которые двигают или сливают тайлы
+
+class LineTransition(NamedTuple):
+    values: bytes # показатели степени двойки после сдвига, как в GameState.cells
+    score_gain: int
+    moved: bool
+    template: LineTemplate
+    occupied: int # маска непустых клеток линии после сдвига, бит i - клетка i
+    pairs: int # пары соседних одинаковых тайлов в линии после сдвига
+    max_merged: int # самый крупный тайл, полученный слиянием, или 0
+    changes: TemplateChanges
+
+class LineCache:
+    def __init__(self, size: int, max_entries: int | None = None):
+        self.size = size
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Ключ - линия доски как bytes показателей (срез GameState.cells)
+        self._forward: OrderedDict[bytes, LineTransition] = OrderedDict() # сдвиг к началу линии (влево/вверх)
+        self._backward: OrderedDict[bytes, LineTransition] = OrderedDict() # сдвиг к концу линии (вправо/вниз)
+        self._spread: Dict[int, int] = {} # маска линии -> маска столбца в нумерации доски (бит i -> бит i * size)
+
+    def get(self, values: bytes, reverse: bool) -> LineTransition:
+        table = self._backward if reverse else self._forward
+        entry = table.get(values)
+        if entry is not None:
+            self.hits += 1
+            if self.max_entries is not None:
+                table.move_to_end(values)
+            return entry
+
+        self.misses += 1
+        entry = self._compute(values, reverse)
+        table[values] = entry
+        if self.max_entries is not None and len(table) > self.max_entries:
+            table.popitem(last=False)
+        return entry
+
+    def spread(self, mask: int) -> int:
+        column = self._spread.get(mask)
+        if column is None:
+            column = 0
+            for i in range(self.size):
+                if mask >> i & 1:
+                    column |= 1 << (i * self.size)
+            self._spread[mask] = column
+        return column
+
+    def __len__(self) -> int:
+        return len(self._forward) + len(self._backward)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+        }
+
+    def clear(self):
+        self._forward.clear()
+        self._backward.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _compute(self, values: bytes, reverse: bool) -> LineTransition:
+        n = self.size
+        order = range(n - 1, -1, -1) if reverse else range(n)
+        tiles = [(values[idx], idx) for idx in order if values[idx] != 0] # (exponent, index)
+
+        new_values = bytearray(n)
+        template = []
+        score_gain = 0
+        max_merged = 0
+        moved = False
+        occupied = 0
+        write = 0
+
+        i = 0
+        while i < len(tiles):
+            value, idx = tiles[i]
+            dst = n - 1 - write if reverse else write
+            if i + 1 < len(tiles) and tiles[i + 1][0] == value:
+                template.append((idx, tiles[i + 1][1], dst))
+                new_values[dst] = value + 1
+                score_gain += 1 << (value + 1)
+                max_merged = max(max_merged, 1 << (value + 1))
+                moved = True
+                i += 2
+            else:
+                template.append((idx, -1, dst))
+                new_values[dst] = value
+                moved = moved or idx != dst
+                i += 1
+            occupied |= 1 << dst
+            write += 1
+
+        new_values = bytes(new_values)
+        template = tuple(template)
+        return LineTransition(new_values, score_gain, moved, template, occupied, count_pairs(new_values), max_merged, template_changes(template))
+
+_line_caches: Dict[int, LineCache] = {}
+
+def count_pairs(line: bytes | Tuple[int, ...] | List[int]) -> int:
+    return sum(1 for a, b in zip(line, line[1:]) if a and a == b)
+
+_template_changes: Dict[LineTemplate, TemplateChanges] = {}
+
+def template_changes(template: LineTemplate) -> TemplateChanges:
+    # Клетки, которые тайл покинул или в которые пришел другой тайл; остальные клетки линии не меняются
+    changes = _template_changes.get(template)
+    if changes is None:
+        changed = 0
+        entries = []
+        for src, src2, dst in template:
+            if src != dst or src2 >= 0:
+                changed |= (1 << src) | (1 << dst) | (1 << src2 if src2 >= 0 else 0)
+                entries.append((src, src2, dst))
+        changes = TemplateChanges(changed, tuple(bit_positions(changed)), tuple(entries))
+        _template_changes[template] = changes
+    return changes
+
+def bit_positions(mask: int) -> List[int]:
+    positions = []
+    while mask:
+        low = mask & -mask
+        positions.append(low.bit_length() - 1)
+        mask ^= low
+    return positions
+
+_BYTE_BITS = [tuple(i for i in range(8) if byte >> i & 1) for byte in range(256)] # позиции единичных битов байта
+
+def nth_set_bit(mask: int, k: int) -> int:
+    # Индекс k-го (с нуля) единичного бита: не больше size * size / 8 шагов по байтам маски
+    shift = 0
+    while True:
+        byte = mask & 0xFF
+        count = byte.bit_count()
+        if k < count:
+            return shift + _BYTE_BITS[byte][k]
+        k -= count
+        mask >>= 8
+        shift += 8
+
+_zobrist_keys: Dict[int, List[int]] = {}
+
+def zobrist_keys(size: int) -> List[int]:
+    # keys[cell << 8 | e] - 64-битный ключ клетки с показателем e; у пустой клетки ключ 0
+    keys = _zobrist_keys.get(size)
+    if keys is None:
+        rng = random.Random(ZOBRIST_SEED + size)
+        keys = []
+        for _ in range(size * size):
+            keys.append(0)
+            keys.extend(rng.getrandbits(64) for _ in range(255))
+        _zobrist_keys[size] = keys
+    return keys
+
+def zobrist_hash(size: int, cells: bytes) -> int:
+    # Хеш позиции по значениям клеток: id тайлов, счет и флаги в него не входят
+    keys = zobrist_keys(size)
+    h = 0
+    for cell, e in enumerate(cells):
+        if e:
+            h ^= keys[cell << 8 | e]
+    return h
+
+def line_cache(size: int) -> LineCache:
+    # Кэш общий для всех движков одного размера: строки повторяются между партиями
+    cache = _line_caches.get(size)
+    if cache is None:
+        cache = LineCache(size, LINE_CACHE_LIMITS.get(size, LARGE_LINE_CACHE_LIMIT))
+        _line_caches[size] = cache
+    return cache
+
+DIRECTIONS = ("u", "d", "l", "r")
+MOVE_UP, MOVE_DOWN, MOVE_LEFT, MOVE_RIGHT = 1, 2, 4, 8
+DIRECTION_BITS = {"u": MOVE_UP, "d": MOVE_DOWN, "l": MOVE_LEFT, "r": MOVE_RIGHT}
+MASK_DIRECTIONS = [tuple(d for d in DIRECTIONS if mask & DIRECTION_BITS[d]) for mask in range(16)] # маска -> направления
+
+VALUES = [0] + [1 << e for e in range(1, 256)] # показатель степени из GameState.cells -> значение тайла
 
-@dataclass
 class GameState:
-    board: List[List[int]]
-    id_board: List[List[int]] # матрица с id тайлов для отслеживания анимаций
-    score: int = 0
-    game_over: bool = False
-    game_won: bool = False
-    next_id: int = 1 # счетчик для присвоения уникальных id новым тайлам
+    # Компактное состояние: показатели степени двойки по клеткам построчно (bytes, 0 - пусто) и id тайлов (array("I")).
+    # Состояние не меняется после того, как ход закончен: спавн пишет только в свежие cells/ids нового состояния.
+    # board и id_board - списки списков для GUI и сохранений, собираются при каждом обращении.
+    # Ход 4x4 без событий (GameEngine.move(record_delta=False)) дает состояние только с bits: cells распаковываются из bits,
+    # а ids - переигрыванием перестановок от ближайшего предка с готовыми ids (origin) при первом обращении
+    __slots__ = ("size", "_cells", "_ids", "score", "game_over", "game_won", "next_id", "bits", "zobrist", "empty_mask", "max_tile", "row_pairs", "column_pairs", "origin")
+
+    def __init__(
+        self,
+        size: int,
+        cells: Optional[bytes],
+        ids: Optional[array],
+        score: int = 0,
+        game_over: bool = False,
+        game_won: bool = False,
+        next_id: int = 1, # счетчик для присвоения уникальных id новым тайлам
+        bits: Optional[int] = None, # упакованная доска 4x4, если она помещается в 64 бита
+        zobrist: Optional[int] = None, # zobrist_hash(size, cells), обновляется ходами и спавнами; None - посчитать по доске
+        empty_mask: Optional[int] = None, # пустые клетки, бит r * size + c; None - пересчитать по доске
+        # Счетчики для проверок конца игры и победы за O(1); у состояний из сохранений считаются по доске при первом обращении
+        max_tile: Optional[int] = None,
+        row_pairs: Optional[int] = None, # одинаковые соседи в строках
+        column_pairs: Optional[int] = None, # одинаковые соседи в столбцах
+        origin: Optional[Tuple[GameState, str, int, int]] = None, # (предыдущее состояние, направление, клетка спавна, длина цепочки) для ids=None
+    ):
+        self.size = size
+        self._cells = cells
+        self._ids = ids # id тайлов для отслеживания анимаций
+        self.score = score
+        self.game_over = game_over
+        self.game_won = game_won
+        self.next_id = next_id
+        self.bits = bits
+        self.zobrist = zobrist
+        self.empty_mask = empty_mask
+        self.max_tile = max_tile
+        self.row_pairs = row_pairs
+        self.column_pairs = column_pairs
+        self.origin = origin
+
+    @property
+    def cells(self) -> bytes:
+        cells = self._cells
+        if cells is None:
+            cells = self._cells = bitboard.decode_cells(self.bits)
+        return cells
+
+    @cells.setter
+    def cells(self, cells: bytes):
+        self._cells = cells
+
+    @property
+    def ids(self) -> array:
+        if self._ids is None:
+            self._materialize_ids()
+        return self._ids
+
+    @ids.setter
+    def ids(self, ids: array):
+        self._ids = ids
+
+    def _materialize_ids(self):
+        # Цепочка состояний без ids до предка, у которого они есть; дальше вперед по шаблонам строк упакованных досок.
+        # После этого ссылка на предка не нужна, и цепочка освобождается
+        chain = []
+        state = self
+        while state._ids is None:
+            chain.append(state)
+            state = state.origin[0]
+        ids = state._ids
+        for state in reversed(chain):
+            parent, direction, cell, _ = state.origin
+            columns = direction in ("d", "u")
+            reverse = direction in ("r", "d")
+            new_ids = array("I", bytes(64))
+            for line, line_bits in enumerate(bitboard.lines(parent.bits, direction)):
+                base, step = (line, 4) if columns else (line * 4, 1)
+                for src, _, dst in bitboard.line_template(line_bits, reverse): # шаблон перечисляет все тайлы линии
+                    new_ids[base + dst * step] = ids[base + src * step]
+            if cell >= 0:
+                new_ids[cell] = parent.next_id
+            state._ids = new_ids
+            state.origin = None
+            ids = new_ids
+
+    @classmethod
+    def from_boards(cls, board: List[List[int]], id_board: List[List[int]], score: int = 0, game_over: bool = False, game_won: bool = False, next_id: int = 1) -> GameState:
+        # Состояние из матриц значений и id (сохранения, пакетный движок)
+        cells = bytes(value.bit_length() - 1 if value else 0 for row in board for value in row)
+        ids = array("I", [tile_id for row in id_board for tile_id in row])
+        return cls(len(board), cells, ids, score, game_over, game_won, next_id)
+
+    @property
+    def board(self) -> List[List[int]]:
+        n = self.size
+        cells = self.cells
+        return [[VALUES[e] for e in cells[i:i + n]] for i in range(0, n * n, n)]
+
+    @property
+    def id_board(self) -> List[List[int]]:
+        n = self.size
+        ids = self.ids
+        return [ids[i:i + n].tolist() for i in range(0, n * n, n)]
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, GameState):
+            return NotImplemented
+        return (
+            self.cells == other.cells and self.score == other.score and self.ids == other.ids
+            and self.game_over == other.game_over and self.game_won == other.game_won and self.next_id == other.next_id
+        )
+
+    def __hash__(self) -> int:
+        # Одинаковые доски с разными id и счетом дают один хеш - это допустимо, __eq__ их различает
+        if self.zobrist is None:
+            self.zobrist = zobrist_hash(self.size, self.cells)
+        return self.zobrist
+
+    def copy(self) -> GameState:
+        # Тот же снимок с собственным массивом ids: спавн дописывается в ids нового состояния на месте
+        return GameState(
+            self.size, self.cells, array("I", self.ids), self.score, self.game_over, self.game_won, self.next_id,
+            self.bits, self.zobrist, self.empty_mask, self.max_tile, self.row_pairs, self.column_pairs,
+        )
+
+    def __reduce__(self):
+        # pickle (процессы MonteCarloSolver, multiprocessing) получает готовые cells/ids без цепочки origin
+        return (GameState, (
+            self.size, self.cells, self.ids, self.score, self.game_over, self.game_won, self.next_id,
+            self.bits, self.zobrist, self.empty_mask, self.max_tile, self.row_pairs, self.column_pairs,
+        ))
+
+    def __repr__(self) -> str:
+        return f"GameState(size={self.size}, board={self.board}, score={self.score}, game_over={self.game_over}, game_won={self.game_won}, next_id={self.next_id})"
+
+class MoveEvent(NamedTuple):
+    tile_id: int
+    from_pos: Tuple[int, int]
+    to_pos: Tuple[int, int]
+
+class MergeEvent(NamedTuple):
+    from_ids: Tuple[int, int]
+    new_id: int # при слиянии сохраняется id первого тайла
+    at: Tuple[int, int]
+    value: int # значение после слияния
+
+class SpawnEvent(NamedTuple):
+    tile_id: int
+    at: Tuple[int, int]
+
+class DeltaBatch:
+    # События одного шага анимации, сразу разложенные по видам: GUI берет нужный список без разбора по типу.
+    # Ход заполняет moves/merges/spawns, отмена - reverses/splits/despawns (те же события в обратную сторону)
+    __slots__ = ("moves", "merges", "spawns", "reverses", "splits", "despawns")
+
+    def __init__(
+        self,
+        moves: Optional[List[MoveEvent]] = None,
+        merges: Optional[List[MergeEvent]] = None,
+        spawns: Optional[List[SpawnEvent]] = None,
+        reverses: Optional[List[MoveEvent]] = None,
+        splits: Optional[List[MergeEvent]] = None,
+        despawns: Optional[List[SpawnEvent]] = None,
+    ):
+        self.moves = moves if moves is not None else []
+        self.merges = merges if merges is not None else []
+        self.spawns = spawns if spawns is not None else []
+        self.reverses = reverses if reverses is not None else []
+        self.splits = splits if splits is not None else []
+        self.despawns = despawns if despawns is not None else []
+
+    def __len__(self) -> int:
+        return len(self.moves) + len(self.merges) + len(self.spawns) + len(self.reverses) + len(self.splits) + len(self.despawns)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DeltaBatch):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        groups = ", ".join(f"{name}={getattr(self, name)}" for name in self.__slots__ if getattr(self, name))
+        return f"DeltaBatch({groups})"
+
+    def inverted(self) -> DeltaBatch:
+        return DeltaBatch(
+            reverses=[MoveEvent(event.tile_id, event.to_pos, event.from_pos) for event in self.moves],
+            splits=list(self.merges),
+            despawns=list(self.spawns),
+        )
+
+class MovePreview(NamedTuple):
+    state: GameState # состояние после сдвига, до спавна
+    score_gain: int
+    moved: bool
+    delta: DeltaBatch
+
+class SequenceResult(NamedTuple):
+    state: GameState # состояние после последнего хода
+    score_gain: int
+    moves: List[Tuple[str, int, int]] # сыгранные ходы: (направление, клетка спавна или -1, значение спавна); ходы без сдвига пропускаются
+    delta: DeltaBatch # итоговые события всей последовательности - один шаг анимации
+
+class MoveLog:
+    # Журнал партии для отмены и повтора на любую глубину: ход занимает 2 байта (направление, клетка и значение спавна),
+    # а каждые interval ходов сохраняется полное состояние, от которого ходы переигрываются.
+    # Общие строки между соседними состояниями истории больше не нужны: плоские cells/ids не делятся на строки,
+    # а журнал дешевле любого снимка: 16-22 байта на ход вместе с ключевыми кадрами на 3x3-8x8 (benchmarks.py history)
+    def __init__(self, initial: GameState, interval: int = KEYFRAME_INTERVAL):
+        self.interval = interval
+        self.records = array("H") # направление (2 бита) | спавн четверки (1 бит) | был спавн (1 бит) | клетка (12 бит)
+        self.keyframes: List[GameState] = [initial] # keyframes[j] - состояние после j * interval ходов
+        self.position = 0 # число сыгранных ходов до текущего состояния; записи дальше него - ходы для повтора
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def append(self, direction: str, cell: int, value: int, state: Optional[GameState]):
+        # Новый ход после отмены отбрасывает ходы для повтора. state нужен, только если next_is_keyframe()
+        if self.position < len(self.records):
+            self.truncate(self.position)
+        code = DIRECTIONS.index(direction) | (value == 4) << 2
+        if cell >= 0:
+            code |= 8 | cell << 4
+        self.records.append(code)
+        self.position += 1
+        if len(self.records) % self.interval == 0:
+            self.keyframes.append(state)
+
+    def next_is_keyframe(self) -> bool:
+        # Следующий append сохранит полное состояние (с учетом отброшенных ходов для повтора)
+        return (self.position + 1) % self.interval == 0
+
+    def record(self, index: int) -> Tuple[str, int, int]:
+        # (направление, клетка спавна или -1, значение спавна)
+        return self.decode(self.records[index])
+
+    @staticmethod
+    def decode(code: int) -> Tuple[str, int, int]:
+        if not code & 8:
+            return DIRECTIONS[code & 3], -1, 0
+        return DIRECTIONS[code & 3], code >> 4, 4 if code & 4 else 2
+
+    def copy(self) -> MoveLog:
+        # Независимая копия для записи из другого потока; состояния ключевых кадров не меняются и не копируются
+        log = MoveLog(self.keyframes[0], self.interval)
+        log.records = array("H", self.records)
+        log.keyframes = list(self.keyframes)
+        log.position = self.position
+        return log
+
+    def truncate(self, length: int):
+        del self.records[length:]
+        del self.keyframes[length // self.interval + 1:]
+        self.position = min(self.position, length)
 
 class GameEngine:
     def __init__(self, size: int, random_seed: int | None = None):
         self.size = size
         self.random_seed = random_seed
         self.rng = random.Random(random_seed)
+        self.lines = line_cache(size)
+        self._previews: Optional[Tuple[GameState, Dict[str, MovePreview]]] = None
         self.state: GameState = self.new_game(size)
-        self.history: List[GameState] = []
-        self.delta_history: List[List[DeltaEvent]] = []
 
     def new_game(self, size: int) -> GameState:
-        board = [[0 for _ in range(size)] for _ in range(size)]
-        id_board = [[0 for _ in range(size)] for _ in range(size)]
-
         self.size = size
+        self.lines = line_cache(size)
+        self.zobrist_keys = zobrist_keys(size)
+        self.symmetry: SymmetryTables = symmetry_tables(size)
+        self.full_mask = (1 << size * size) - 1
+        first_column = sum(1 << (r * size) for r in range(size))
+        self.not_first_column = self.full_mask ^ first_column
+        self.not_last_column = self.full_mask ^ (first_column << (size - 1))
 
-        state = GameState(board=board, id_board=id_board, score=0, game_over=False, game_won=False, next_id=1)
+        state = GameState(size, bytes(size * size), array("I", bytes(4 * size * size)), zobrist=0, empty_mask=self.full_mask, max_tile=0, row_pairs=0, column_pairs=0)
 
         self.rng = random.Random(self.random_seed)
 
         state = self._spawn_tile(state)
         state = self._spawn_tile(state)
-        self.history = []
-        self.delta_history = []
+        self._previews = None
+        self.log = MoveLog(state)
         self.state = state
 
         return state
+
+    def set_state(self, state: GameState, log: Optional[MoveLog] = None):
+        # Подмена состояния снаружи (загрузка, роллауты): журнал начинается с него, если не передан свой.
+        # Переданный журнал должен стоять на позиции, соответствующей state
+        self.state = state
+        self.log = log if log is not None else MoveLog(state)
+        self._previews = None
     
-    def move(self, direction: str) -> Tuple[GameState, bool, List[DeltaEvent]]:
-        new_board, new_id_board, score_gain, moved, delta = self._move(self.state.board, self.state.id_board, direction)
-        if not moved:
-            return self.state, False, []
-        
-        new_state = replace(
-            self.state,
-            board=new_board,
-            id_board=new_id_board,
-            score=self.state.score + score_gain,
-        )
+    def move(self, direction: str, record_delta: bool = True) -> Tuple[GameState, bool, DeltaBatch]:
+        # record_delta=False - режим для симуляций: события анимации не создаются (отмена восстановит их переигрыванием)
+        state = self.state
+        if not record_delta and state.bits is not None:
+            result = self._move_packed(state, direction)
+            if result is not None:
+                return result
+        preview = None
+        if self._previews is not None and self._previews[0] is state:
+            preview = self._previews[1][direction] # ход уже посчитан в preview_all, события в нем записаны
+            record_delta = True
+        shared = preview is not None
+        self._previews = None
+        if preview is None:
+            preview = self._preview(state, direction, record_delta)
+        if not preview.moved:
+            return state, False, DeltaBatch()
 
-        if any(2048 in row for row in new_board):
-            new_state.game_won = True
+        new_state = preview.state
+        delta = preview.delta
+        if shared: # предпросмотр уже отдан наружу: спавн пишется в копии, а не в состояние и события из preview_all
+            new_state = new_state.copy()
+            delta = DeltaBatch(list(delta.moves), list(delta.merges), list(delta.spawns))
+        cell, value = self._pick_spawn(new_state)
+        spawn_event = self._finish_move(new_state, cell, value)
+        if spawn_event and record_delta:
+            delta.spawns.append(spawn_event)
 
-        new_state, spawn_event = self._spawn_tile(new_state, return_event=True)
-        if spawn_event:
-            delta.append(spawn_event)
+        self.log.append(direction, cell, value, new_state)
+        self.state = new_state
+        return new_state, True, delta
 
-        new_state.game_over = self._check_game_over(new_state.board)
+    def _move_packed(self, state: GameState, direction: str) -> Optional[Tuple[GameState, bool, DeltaBatch]]:
+        # Ход 4x4 без событий целиком на упакованной доске: новое состояние получает только bits, счет, флаги и маску пустых,
+        # cells и ids собираются при первом обращении (GameState.cells/ids). Спавн и журнал - те же, что в обычном пути.
+        # None - ход дает тайл 32768, который не помещается в 4 бита; его делает обычный путь
+        self._previews = None
+        bits = state.bits
+        new_bits, score_gain = bitboard.move(bits, direction)
+        if new_bits == bits:
+            return state, False, DeltaBatch()
+        if not bitboard.is_safe(new_bits):
+            return None
 
-        self.history.append(self.state)
-        self.delta_history.append(delta)
+        empty = bitboard.occupied_mask(new_bits) ^ 0xFFFF
+        cell, value = self._pick_cell(empty)
+        next_id = state.next_id
+        if cell >= 0:
+            new_bits |= (1 if value == 2 else 2) << (4 * cell)
+            empty ^= 1 << cell
+            next_id += 1
+        game_won = state.game_won or (score_gain >= 2048 and max(bitboard.decode_cells(new_bits)) >= 11) # 2048 - показатель 11
+        game_over = not empty and bitboard.move(new_bits, "l")[0] == new_bits and bitboard.move(new_bits, "u")[0] == new_bits
+
+        depth = state.origin[3] + 1 if state.origin is not None else 1
+        new_state = GameState(4, None, None, state.score + score_gain, game_over, game_won, next_id, bits=new_bits, empty_mask=empty, origin=(state, direction, cell, depth))
+        if depth >= ORIGIN_CHAIN_LIMIT:
+            new_state.ids # цепочка держит все состояния после предка с ids: серия ходов без обращений к ids сворачивается здесь
+        self.log.append(direction, cell, value, new_state)
         self.state = new_state
+        return new_state, True, DeltaBatch()
+
+    def apply_moves(self, directions: Iterable[str], record_delta: bool = True) -> SequenceResult:
+        # Вся последовательность (например "llurd") за один вызов, с теми же спавнами и журналом, что у move() по очереди.
+        # Между ходами живут только cells/ids и счетчики: GameState создается для ключевых кадров журнала и в конце,
+        # события отдельных ходов не записываются - запоминается только, какой тайл каким поглощен
+        start = self.state
+        self._previews = None
+        n = self.size
+        keys = self.zobrist_keys
+        log = self.log
+        cells, ids = start.cells, start.ids
+        zobrist = self._zobrist(start)
+        empty = self._empty_mask(start)
+        self._count_pairs(start)
+        row_pairs, column_pairs = start.row_pairs, start.column_pairs
+        max_tile = self._max_tile(start)
+        bits = self._bitboard(start)
+        score, next_id, game_won, game_over = start.score, start.next_id, start.game_won, start.game_over
+        absorbed: Optional[Dict[int, int]] = {} if record_delta else None # id поглощенного тайла -> id поглотившего
+        moves: List[Tuple[str, int, int]] = []
 
-        if len(self.history) > 10:
-            self.history.pop(0)
-            self.delta_history.pop(0)
+        for direction in directions:
+            if bits is not None:
+                new_bits, score_gain = bitboard.move(bits, direction)
+                if new_bits == bits:
+                    continue
+                cells, ids, zobrist_delta, _ = self._move_bitboard(bits, new_bits, cells, ids, direction, False, absorbed)
+                occupied = bitboard.occupied_mask(new_bits)
+                row_pairs_after, column_pairs_after = bitboard.pair_counts(new_bits)
+                max_merged = VALUES[max(cells)] if score_gain else 0
+                bits = new_bits if bitboard.is_safe(new_bits) else None
+            else:
+                new_cells, new_ids, zobrist_delta, score_gain, moved, _, occupied, row_pairs_after, column_pairs_after, max_merged = self._move(cells, ids, direction, False, absorbed=absorbed)
+                if not moved:
+                    continue
+                cells, ids = new_cells, new_ids
+            zobrist ^= zobrist_delta
+            empty = occupied ^ self.full_mask
+            row_pairs, column_pairs = row_pairs_after, column_pairs_after
+            score += score_gain
+            max_tile = max(max_tile, max_merged)
+            if max_tile >= 2048:
+                game_won = True
 
-        return new_state, True, delta
-    
-    def undo(self):
-        if not self.history:
-            return self.state, False, []
-        
-        prev_state = self.history.pop()
-        delta = self.delta_history.pop()
-        inverted_delta: List[DeltaEvent] = []
-        for event in delta:
-            if event["type"] == "spawn":
-                inverted_delta.append({
-                    "type": "despawn",
-                    "id": event["id"],
-                    "at": event["at"],
-                })
-            elif event["type"] == "move":
-                inverted_delta.append({
-                    "type": "reverse",
-                    "id": event["id"],
-                    "from": event["to"],
-                    "to": event["from"],
-                })
-            elif event["type"] == "merge":
-                inverted_delta.append({
-                    "type": "split",
-                    "from_ids": event["from_ids"],
-                    "new_id": event["new_id"],
-                    "at": event["at"],
-                    "value": event["value"],
-                })
+            cell, value = self._pick_cell(empty)
+            if cell >= 0:
+                e = value.bit_length() - 1
+                row_delta, column_delta = self._spawn_pairs(cells, cell, e)
+                row_pairs += row_delta
+                column_pairs += column_delta
+                max_tile = max(max_tile, value)
+                cells = cells[:cell] + bytes((e,)) + cells[cell + 1:]
+                ids[cell] = next_id # массив свежий - его создал _move
+                next_id += 1
+                zobrist ^= keys[cell << 8 | e]
+                empty ^= 1 << cell
+                if bits is not None:
+                    bits |= e << (4 * cell)
+            game_over = not empty and not row_pairs and not column_pairs
+
+            keyframe = None
+            if log.next_is_keyframe():
+                keyframe = GameState(n, cells, ids, score, game_over, game_won, next_id, bits=bits, zobrist=zobrist, empty_mask=empty, max_tile=max_tile, row_pairs=row_pairs, column_pairs=column_pairs)
+            log.append(direction, cell, value, keyframe)
+            moves.append((direction, cell, value))
+
+        if not moves:
+            return SequenceResult(start, 0, moves, DeltaBatch())
+        state = GameState(n, cells, ids, score, game_over, game_won, next_id, bits=bits, zobrist=zobrist, empty_mask=empty, max_tile=max_tile, row_pairs=row_pairs, column_pairs=column_pairs)
+        self.state = state
+        delta = self._coalesce(start, state, absorbed) if absorbed is not None else DeltaBatch()
+        return SequenceResult(state, score - start.score, moves, delta)
+
+    def _coalesce(self, start: GameState, state: GameState, absorbed: Dict[int, int]) -> DeltaBatch:
+        # Итоговая дельта: каждый тайл начальной доски один раз едет туда, где в конце стоит он сам или поглотивший его тайл,
+        # поглощенные тайлы дают по одному слиянию с итоговым значением, новые тайлы конечной доски - спавны
+        n = self.size
+        start_cells = {tile_id: cell for cell, tile_id in enumerate(start.ids) if tile_id}
+        final_cells = {tile_id: cell for cell, tile_id in enumerate(state.ids) if tile_id}
+
+        def survivor(tile_id: int) -> int:
+            while tile_id in absorbed:
+                tile_id = absorbed[tile_id]
+            return tile_id
+
+        delta = DeltaBatch()
+        for tile_id, cell in start_cells.items():
+            target = final_cells[survivor(tile_id)]
+            if target != cell:
+                delta.moves.append(MoveEvent(tile_id, divmod(cell, n), divmod(target, n)))
+        for tile_id in absorbed:
+            if tile_id not in start_cells: # тайл появился и поглощен внутри серии: на доске его не видно ни до, ни после
+                continue
+            winner = survivor(tile_id)
+            target = final_cells[winner]
+            delta.merges.append(MergeEvent((winner, tile_id), winner, divmod(target, n), VALUES[state.cells[target]]))
+        for tile_id, cell in final_cells.items():
+            if tile_id not in start_cells:
+                delta.spawns.append(SpawnEvent(tile_id, divmod(cell, n)))
+        return delta
+
+    def play_record(self, direction: str, cell: int, value: int) -> GameState:
+        # Ход с заранее известным спавном (восстановление из журнала на диске); ход, который ничего не сдвигает, - ошибка
+        self._previews = None
+        preview = self._preview(self.state, direction, False)
+        if not preview.moved:
+            raise ValueError(f"move {direction!r} does not change the board")
+        new_state = preview.state
+        self._finish_move(new_state, cell, value)
+        self.log.append(direction, cell, value, new_state)
+        self.state = new_state
+        return new_state
+
+    def undo(self) -> Tuple[GameState, bool, DeltaBatch]:
+        # Предыдущее состояние восстанавливается от ближайшего ключевого кадра, отменяемый ход переигрывается ради событий.
+        # Ход остается в журнале для redo()
+        position = self.log.position
+        if not position:
+            return self.state, False, DeltaBatch()
+
+        prev_state = self._state_at(position - 1)
+        _, delta = self._replay(prev_state, position - 1, record_delta=True)
+        self.log.position = position - 1
         self.state = prev_state
-        return prev_state, True, inverted_delta
-    
-    def _spawn_tile(self, state: GameState, *, return_event: bool = False) -> Tuple[GameState, Optional[DeltaEvent]] | GameState:
-        empties = []
-        for r in range(self.size):
-            for c in range(self.size):
-                if state.board[r][c] == 0:
-                    empties.append((r, c))
-        if not empties:
-            return (state, None) if return_event else state
-        
-        r, c = self.rng.choice(empties)
+        self._previews = None
+        return prev_state, True, delta.inverted()
+
+    def redo(self) -> Tuple[GameState, bool, DeltaBatch]:
+        position = self.log.position
+        if position >= len(self.log):
+            return self.state, False, DeltaBatch()
+
+        new_state, delta = self._replay(self.state, position, record_delta=True)
+        self.log.position = position + 1
+        self.state = new_state
+        self._previews = None
+        return new_state, True, delta
+
+    def seek(self, move_index: int) -> Tuple[GameState, bool, DeltaBatch]:
+        # Переход к состоянию после move_index ходов: не больше interval переигранных ходов от ключевого кадра.
+        # Соседние позиции отдают события как undo()/redo(), дальние - пустую дельту (доска перерисовывается целиком)
+        if not 0 <= move_index <= len(self.log):
+            raise IndexError(f"move index {move_index} out of range 0..{len(self.log)}")
+        position = self.log.position
+        if move_index == position:
+            return self.state, False, DeltaBatch()
+        if move_index == position - 1:
+            return self.undo()
+        if move_index == position + 1:
+            return self.redo()
+
+        self.state = self._state_at(move_index)
+        self.log.position = move_index
+        self._previews = None
+        return self.state, True, DeltaBatch()
+
+    def log_from_states(self, states: List[GameState]) -> MoveLog:
+        # Журнал по цепочке состояний из старых сохранений: направление и спавн каждого хода подбираются переигрыванием.
+        # Если переход не восстанавливается, журнал начинается заново со следующего состояния
+        log = MoveLog(states[0])
+        current = states[0]
+        for target in states[1:]:
+            for direction in DIRECTIONS:
+                preview = self._preview(current, direction, False)
+                spawn = self._find_spawn(preview.state, target) if preview.moved else None
+                if spawn is None:
+                    continue
+                new_state = preview.state
+                self._finish_move(new_state, *spawn)
+                if new_state.cells == target.cells and new_state.ids == target.ids and new_state.score == target.score:
+                    log.append(direction, *spawn, new_state)
+                    current = new_state
+                    break
+            else:
+                log = MoveLog(target)
+                current = target
+        return log
+
+    def _find_spawn(self, state: GameState, target: GameState) -> Optional[Tuple[int, int]]:
+        spawn = None
+        for cell, (e, target_e) in enumerate(zip(state.cells, target.cells)):
+            if e != target_e:
+                if e or spawn is not None or target_e not in (1, 2):
+                    return None
+                spawn = (cell, VALUES[target_e])
+        return spawn if spawn is not None else (-1, 0)
+
+    def _state_at(self, index: int) -> GameState:
+        log = self.log
+        keyframe = index // log.interval
+        state = log.keyframes[keyframe]
+        for i in range(keyframe * log.interval, index):
+            state, _ = self._replay(state, i, record_delta=False)
+        return state
+
+    def _replay(self, state: GameState, index: int, record_delta: bool) -> Tuple[GameState, DeltaBatch]:
+        direction, cell, value = self.log.record(index)
+        preview = self._preview(state, direction, record_delta)
+        new_state = preview.state
+        delta = preview.delta
+        spawn_event = self._finish_move(new_state, cell, value)
+        if spawn_event and record_delta:
+            delta.spawns.append(spawn_event)
+        return new_state, delta
+
+    def _finish_move(self, state: GameState, cell: int, value: int) -> Optional[SpawnEvent]:
+        # Победа, спавн и конец игры для состояния после сдвига
+        if state.max_tile >= 2048:
+            state.game_won = True
+        spawn_event = self._place_tile(state, cell, value) if cell >= 0 else None
+        state.game_over = not state.empty_mask and not state.row_pairs and not state.column_pairs
+        return spawn_event
+
+    def _spawn_tile(self, state: GameState, *, return_event: bool = False) -> Tuple[GameState, Optional[SpawnEvent]] | GameState:
+        cell, value = self._pick_spawn(state)
+        event = self._place_tile(state, cell, value) if cell >= 0 else None
+        return (state, event) if return_event else state
+
+    def _pick_spawn(self, state: GameState) -> Tuple[int, int]:
+        return self._pick_cell(self._empty_mask(state))
+
+    def _pick_cell(self, empty_mask: int) -> Tuple[int, int]:
+        # Случайные вызовы те же, что при rng.choice по списку пустых клеток в порядке обхода строк; (-1, 0) - пустых нет
+        if not empty_mask:
+            return -1, 0
+        cell = nth_set_bit(empty_mask, self.rng.choice(range(empty_mask.bit_count())))
         value = 2 if self.rng.random() < 0.9 else 4
+        return cell, value
+
+    def _place_tile(self, state: GameState, cell: int, value: int) -> SpawnEvent:
+        # Массив id у state должен быть свежим (из new_game или move): новый id пишется в него на месте
+        n = self.size
+        r, c = divmod(cell, n)
         new_id = state.next_id
+        e = value.bit_length() - 1
 
-        new_board = [row[:] for row in state.board]
-        new_id_board = [row[:] for row in state.id_board]
+        self._count_pairs(state) # счетчики должны быть посчитаны до изменения доски
+        cells = state.cells
+        row_delta, column_delta = self._spawn_pairs(cells, cell, e)
+        state.row_pairs += row_delta
+        state.column_pairs += column_delta
+        state.max_tile = max(self._max_tile(state), value)
 
-        new_board[r][c] = value
-        new_id_board[r][c] = new_id
+        state.cells = cells[:cell] + bytes((e,)) + cells[cell + 1:]
+        if state.zobrist is not None:
+            state.zobrist ^= self.zobrist_keys[cell << 8 | e]
+        state.ids[cell] = new_id
+        state.empty_mask = self._empty_mask(state) ^ (1 << cell)
+        state.next_id = new_id + 1
+        if state.bits is not None:
+            state.bits |= e << (4 * cell)
 
-        event = {"type": "spawn", "id": new_id, "at": (r, c)}
-        new_state = replace(state, board=new_board, id_board=new_id_board, next_id=state.next_id + 1)
+        return SpawnEvent(new_id, (r, c))
 
-        return (new_state, event) if return_event else new_state
-    
-    def _move(self, vals_board: List[List[int]], ids_board: List[List[int]], direction: str) -> Tuple[List[List[int]], List[List[int]], int, bool, List[DeltaEvent]]:
+    def _spawn_pairs(self, cells: bytes, cell: int, e: int) -> Tuple[int, int]:
+        # Новые пары в строке и столбце от тайла e в пустой клетке cell
         n = self.size
-        delta: List[DeltaEvent] = []
+        r, c = divmod(cell, n)
+        return (c > 0 and cells[cell - 1] == e) + (c + 1 < n and cells[cell + 1] == e), (r > 0 and cells[cell - n] == e) + (r + 1 < n and cells[cell + n] == e)
 
-        original_vals_board = [row[:] for row in vals_board]
-        work_vals_board = [row[:] for row in vals_board]
+    def _empty_mask(self, state: GameState) -> int:
+        if state.empty_mask is None: # состояния из сохранений получают маску при первом обращении
+            state.empty_mask = sum(1 << cell for cell, e in enumerate(state.cells) if not e)
+        return state.empty_mask
 
-        original_ids_board = [row[:] for row in ids_board]
-        work_ids_board = [row[:] for row in ids_board]
+    def preview_all(self, state: Optional[GameState] = None) -> Dict[str, MovePreview]:
+        # Результаты всех четырех ходов без спавна. Линии доски извлекаются один раз: строки общие для l/r,
+        # столбцы - для u/d; на 4x4 все ходы считаются по одному транспонированию. Недопустимые ходы не считаются вовсе.
+        # Для текущего состояния результат запоминается, и следующий move() берет готовый ход
+        if state is None:
+            state = self.state
+        legal = self.available_moves(state)
+        bits = self._bitboard(state)
+        if bits is not None:
+            bitboard_moves = bitboard.move_all(bits)
+        else:
+            rows, columns = self._lines(state.cells)
 
-        if direction in ("d", "u"):
-            work_vals_board = [list(row) for row in zip(*work_vals_board)] # Транспонируем текущую доску. Теперь движение вверх/вниз - это движение влево/вправо по транспонированной доске.
-            work_ids_board = [list(row) for row in zip(*work_ids_board)]
+        previews: Dict[str, MovePreview] = {}
+        for i, direction in enumerate(DIRECTIONS):
+            if not legal & DIRECTION_BITS[direction]:
+                previews[direction] = MovePreview(state, 0, False, DeltaBatch())
+            elif bits is not None:
+                previews[direction] = self._preview(state, direction, True, moved_bits=bitboard_moves[i])
+            else:
+                previews[direction] = self._preview(state, direction, True, lines=columns if direction in ("u", "d") else rows)
+
+        if state is self.state:
+            self._previews = (state, previews)
+        return previews
+
+    def _preview(self, state: GameState, direction: str, record_delta: bool, moved_bits: Optional[Tuple[int, int]] = None, lines: Optional[List[bytes]] = None) -> MovePreview:
+        max_tile = self._max_tile(state)
+        bits = self._bitboard(state)
+        if bits is not None:
+            new_bits, score_gain = moved_bits or bitboard.move(bits, direction)
+            if new_bits == bits:
+                return MovePreview(state, 0, False, DeltaBatch())
+            new_cells, new_ids, zobrist_delta, delta = self._move_bitboard(bits, new_bits, state.cells, state.ids, direction, record_delta)
+            occupied = bitboard.occupied_mask(new_bits)
+            row_pairs, column_pairs = bitboard.pair_counts(new_bits)
+            if score_gain:
+                max_tile = max(max_tile, VALUES[max(new_cells)])
+            if not bitboard.is_safe(new_bits):
+                new_bits = None
+        else:
+            new_cells, new_ids, zobrist_delta, score_gain, moved, delta, occupied, row_pairs, column_pairs, max_merged = self._move(state.cells, state.ids, direction, record_delta, lines)
+            if not moved:
+                return MovePreview(state, 0, False, DeltaBatch())
+            new_bits = None
+            max_tile = max(max_tile, max_merged)
+
+        new_state = GameState(
+            self.size,
+            new_cells,
+            new_ids,
+            state.score + score_gain,
+            state.game_over,
+            state.game_won,
+            state.next_id,
+            bits=new_bits,
+            zobrist=self._zobrist(state) ^ zobrist_delta,
+            empty_mask=occupied ^ self.full_mask,
+            max_tile=max_tile,
+            row_pairs=row_pairs,
+            column_pairs=column_pairs,
+        )
+        return MovePreview(new_state, score_gain, True, delta)
+
+    def _zobrist(self, state: GameState) -> int:
+        if state.zobrist is None:
+            state.zobrist = zobrist_hash(self.size, state.cells)
+        return state.zobrist
+
+    def _max_tile(self, state: GameState) -> int:
+        if state.max_tile is None:
+            state.max_tile = VALUES[max(state.cells)]
+        return state.max_tile
+
+    def _count_pairs(self, state: GameState):
+        if state.row_pairs is None or state.column_pairs is None:
+            if state.bits is not None:
+                state.row_pairs, state.column_pairs = bitboard.pair_counts(state.bits)
+                return
+            empty = self._empty_mask(state)
+            state.row_pairs = self._row_pairs(state.cells, empty)
+            state.column_pairs = self._column_pairs(state.cells, empty)
+
+    # Пары считаются сравнением доски со сдвинутой копией целиком (цикл внутри map), без обхода линий в Python:
+    # на больших досках это основная стоимость хода. Совпавшие пустые клетки вычитаются по маске пустых
+
+    def _row_pairs(self, cells: bytes, empty: int) -> int:
+        n = self.size
+        equal = sum(map(eq, cells, cells[1:])) - sum(map(eq, cells[n - 1::n], cells[n::n])) # без пар через край строки
+        return equal - (empty & empty >> 1 & self.not_last_column).bit_count()
+
+    def _column_pairs(self, cells: bytes, empty: int) -> int:
+        n = self.size
+        return sum(map(eq, cells, cells[n:])) - (empty & empty >> n).bit_count()
+
+    def available_moves(self, state: Optional[GameState] = None) -> int:
+        # Маска допустимых ходов (DIRECTION_BITS). Ход возможен, если есть слияние вдоль направления
+        # или тайл с пустой клеткой перед ним; состояние не меняется
+        if state is None:
+            state = self.state
+        n = self.size
+        empty = self._empty_mask(state)
+        occupied = empty ^ self.full_mask
+        self._count_pairs(state)
 
-        new_vals_board = []
-        new_ids_board = []
+        mask = 0
+        if state.column_pairs or occupied & (empty << n):
+            mask |= MOVE_UP
+        if state.column_pairs or occupied & (empty >> n):
+            mask |= MOVE_DOWN
+        if state.row_pairs or occupied & (empty << 1) & self.not_first_column:
+            mask |= MOVE_LEFT
+        if state.row_pairs or occupied & (empty >> 1) & self.not_last_column:
+            mask |= MOVE_RIGHT
+        return mask
+
+    def _bitboard(self, state: GameState) -> Optional[int]:
+        if self.size != 4:
+            return None
+        if state.bits is None:
+            state.bits = bitboard.encode_cells(state.cells) # доски из сохранений упаковываются при первом ходе
+        return state.bits
+
+    def _lines(self, cells: bytes) -> Tuple[List[bytes], List[bytes]]:
+        # Строки и столбцы плоской доски как срезы bytes - ключи LineCache
+        n = self.size
+        return [cells[i:i + n] for i in range(0, n * n, n)], [cells[c::n] for c in range(n)]
+
+    def _join_lines(self, values: List[bytes], columns: bool) -> bytes:
+        if not columns:
+            return b"".join(values)
+        n = self.size
+        cells = bytearray(n * n)
+        for c, column in enumerate(values):
+            cells[c::n] = column
+        return bytes(cells)
+
+    def canonical(self, cells: bytes) -> Tuple[bytes, int]:
+        # Каноническая из восьми ориентаций доски и преобразование t, которое к ней приводит.
+        # Ход d на исходной доске соответствует ходу symmetry.transform_direction(d, t) на канонической;
+        # обратно - transform(canonical, symmetry.inverse(t)) и transform_direction(d, symmetry.inverse(t))
+        return self.symmetry.canonical(cells)
+
+    def transform(self, cells: bytes, t: int) -> bytes:
+        return self.symmetry.transform(cells, t)
+
+    def simulate_move(self, cells: bytes, direction: str) -> Tuple[bytes, int, bool]:
+        # Только показатели клеток (как GameState.cells): без id, событий, спавна и истории. Для стратегий и поиска
+        bits = bitboard.encode_cells(cells) if self.size == 4 else None
+        if bits is not None:
+            new_bits, score_gain = bitboard.move(bits, direction)
+            if new_bits == bits:
+                return cells, 0, False
+            return bitboard.decode_cells(new_bits), score_gain, True
+
+        columns = direction in ("d", "u")
+        reverse = direction in ("r", "d")
+        get = self.lines.get
+        entries = [get(line, reverse) for line in self._lines(cells)[columns]]
+        if not any(entry.moved for entry in entries):
+            return cells, 0, False
+
+        score_gain = sum(entry.score_gain for entry in entries)
+        return self._join_lines([entry.values for entry in entries], columns), score_gain, True
+
+    def _move_bitboard(self, bits: int, new_bits: int, cells: bytes, ids: array, direction: str, record_delta: bool = True, absorbed: Optional[Dict[int, int]] = None) -> Tuple[bytes, array, int, DeltaBatch]:
+        # Значения берутся из таблиц переходов, а id и события восстанавливаются по шаблону строки
+        delta = DeltaBatch()
+        columns = direction in ("d", "u")
+        reverse = direction in ("r", "d")
+        changes = [template_changes(bitboard.line_template(line_bits, reverse)) for line_bits in bitboard.lines(bits, direction)]
+        new_ids, zobrist_delta = self._apply_changes(changes, columns, cells, ids, delta if record_delta else None, absorbed)
+        return bitboard.decode_cells(new_bits), new_ids, zobrist_delta, delta
+
+    def _move(self, cells: bytes, ids: array, direction: str, record_delta: bool = True, lines: Optional[List[bytes]] = None, absorbed: Optional[Dict[int, int]] = None) -> Tuple[bytes, array, int, int, bool, DeltaBatch, int, int, int, int]:
+        delta = DeltaBatch()
+        columns = direction in ("d", "u")
+        reverse = direction in ("r", "d")
+        cache = self.lines
+
+        if lines is None:
+            lines = self._lines(cells)[columns] # столбцы при движении вверх/вниз, строки - влево/вправо
+        entries = [cache.get(line, reverse) for line in lines]
         total_score_gain = 0
+        max_merged = 0
+        pairs = 0
+        moved = False
+        occupied = 0
 
-        for row in range(n):
-            vals = work_vals_board[row][:]
-            ids = work_ids_board[row][:]
-            if direction in ("r", "d"):
-                vals = vals[::-1] # Разворачиваем строку при направлении вправо/вниз, чтобы всегда двигаться влево(выполнять одни и теже действия с доской).
-                ids = ids[::-1]
-
-            new_vals, new_ids, score_gain, row_delta = self._compress_line(vals, ids)
-            total_score_gain += score_gain
-
-            if direction in ("r", "d"):
-                new_vals = new_vals[::-1]
-                new_ids = new_ids[::-1]
-                for event in row_delta:
-                    if event["type"] == "move":
-                        event["from_idx"] = n - 1 - event["from_idx"]
-                        event["to_idx"] = n - 1 - event["to_idx"]
-                    elif event["type"] == "merge":
-                        event["at_idx"] = n - 1 - event["at_idx"]
-
-            for event in row_delta:
-                if event["type"] == "move":
-                    cur_row, cur_from, cur_to = row, event["from_idx"], event["to_idx"] 
-                    if direction in ("d", "u"):
-                        delta.append({
-                            "type": "move",
-                            "id": event["id"],
-                            "from": (cur_from, cur_row),
-                            "to": (cur_to, cur_row),
-                        })
-                    else:
-                        delta.append({
-                            "type": "move",
-                            "id": event["id"],
-                            "from": (cur_row, cur_from),
-                            "to": (cur_row, cur_to),
-                        })
-                elif event["type"] == "merge":
-                    cur_row, cur_at = row, event["at_idx"]
-                    if direction in ("d", "u"):
-                        delta.append({
-                            "type": "merge",
-                            "from_ids": event["from_ids"],
-                            "new_id": event["new_id"],
-                            "at": (cur_at, cur_row),
-                            "value": event["value"],
-                        })
-                    else:
-                        delta.append({
-                            "type": "merge",
-                            "from_ids": event["from_ids"],
-                            "new_id": event["new_id"],
-                            "at": (cur_row, cur_at),
-                            "value": event["value"],
-                        })
-
-            new_vals_board.append(new_vals)
-            new_ids_board.append(new_ids)
-
-        if direction in ("d","u"):
-            new_vals_board = [list(row) for row in zip(*new_vals_board)]
-            new_ids_board = [list(row) for row in zip(*new_ids_board)]
-
-
-        return new_vals_board, new_ids_board, total_score_gain, (original_vals_board != new_vals_board), delta
-    
-    def _compress_line(self, vals_row: List[int], ids_row: List[int]) -> Tuple[List[int], List[int], int, List[DeltaEvent]]:
-        n = len(vals_row)
-        tiles = [(vals_row[i], ids_row[i], i) for i in range(n) if vals_row[i] != 0] # (value, id, index)
-
-        new_vals = []
-        new_ids = []
-        event = []
-        write_idx = 0
-        score_gain = 0
+        for line, entry in enumerate(entries):
+            total_score_gain += entry.score_gain
+            max_merged = max(max_merged, entry.max_merged)
+            pairs += entry.pairs
+            moved = moved or entry.moved
+            occupied |= cache.spread(entry.occupied) << line if columns else entry.occupied << (line * self.size)
 
-        i = 0
-        while i < len(tiles):
-            val_tile, id_tile, idx_tile = tiles[i]
-
-            if i + 1 < len(tiles) and tiles[i][0] == tiles[i + 1][0]:
-                val_tile2, id_tile2, idx_tile2 = tiles[i + 1]
-                new_val = val_tile * 2
-                new_id = id_tile # сохраняем id первого тайла при слиянии
-
-                if idx_tile != write_idx:
-                    event.append({
-                        "type": "move",
-                        "id": id_tile,
-                        "from_idx": idx_tile,
-                        "to_idx": write_idx,
-                    })
-                if idx_tile2 != write_idx:
-                    event.append({
-                        "type": "move",
-                        "id": id_tile2,
-                        "from_idx": idx_tile2,
-                        "to_idx": write_idx,
-                    })
-
-                event.append({
-                    "type": "merge",
-                    "from_ids": [id_tile, id_tile2],
-                    "new_id": new_id,
-                    "at_idx": write_idx,
-                    "value" : new_val,
-                })
-                new_vals.append(new_val)
-                new_ids.append(new_id)
-                score_gain += new_val
-                write_idx += 1
-                i += 2
-            else:
-                if idx_tile != write_idx:
-                    event.append({
-                        "type": "move",
-                        "id": id_tile,
-                        "from_idx": idx_tile,
-                        "to_idx": write_idx,
-                    })
-                new_vals.append(val_tile)
-                new_ids.append(id_tile)
-                write_idx += 1
-                i += 1
+        new_ids, zobrist_delta = self._apply_changes([entry.changes for entry in entries], columns, cells, ids, delta if record_delta else None, absorbed)
 
-        new_vals += [0] * (n - len(new_vals))
-        new_ids += [0] * (n - len(new_ids))
+        # Пары вдоль направления хода известны из переходов, поперек - считаются по всей новой доске
+        new_cells = self._join_lines([entry.values for entry in entries], columns)
+        empty = occupied ^ self.full_mask
+        row_pairs, column_pairs = (self._row_pairs(new_cells, empty), pairs) if columns else (pairs, self._column_pairs(new_cells, empty))
 
-        return new_vals, new_ids, score_gain, event
+        return new_cells, new_ids, zobrist_delta, total_score_gain, moved, delta, occupied, row_pairs, column_pairs, max_merged
 
-    def _check_game_over(self, board: List[List[int]]) -> bool:
-        for i in range(self.size):
-            for j in range(self.size):
-                if board[i][j] == 0:
-                    return False
-                if j + 1 < self.size and board[i][j] == board[i][j + 1]:
-                    return False
-                if i + 1 < self.size and board[i][j] == board[i + 1][j]:
-                    return False
-        return True
+    def _apply_changes(self, changes: List[TemplateChanges], columns: bool, cells: bytes, ids: array, delta: Optional[DeltaBatch], absorbed: Optional[Dict[int, int]] = None) -> Tuple[array, int]:
+        # Новый массив id - копия старого, в которой переписаны только клетки, затронутые шаблонами.
+        # Вместе с ним возвращается изменение хеша Zobrist: старые значения этих клеток уходят, тайлы на местах назначения приходят.
+        # absorbed получает пары (id поглощенного тайла -> id поглотившего) для apply_moves
+        n = self.size
+        keys = self.zobrist_keys
+        new_ids = ids[:]
+        zobrist_delta = 0
+        for line, change in enumerate(changes):
+            if not change.changed:
+                continue
+            base, step = (line, n) if columns else (line * n, 1) # клетка i линии - base + i * step на плоской доске
+            for i in change.cells:
+                cell = base + i * step
+                new_ids[cell] = 0
+                zobrist_delta ^= keys[cell << 8 | cells[cell]]
+            for src, src2, dst in change.template:
+                zobrist_delta ^= keys[(base + dst * step) << 8 | cells[base + src * step] + (src2 >= 0)]
+                if src2 >= 0 and absorbed is not None:
+                    absorbed[ids[base + src2 * step]] = ids[base + src * step]
+            self._apply_template(change.template, base, step, cells, ids, new_ids, delta)
+        return new_ids, zobrist_delta
+
+    def _apply_template(self, template: LineTemplate, base: int, step: int, cells: bytes, ids: array, new_ids: array, delta: Optional[DeltaBatch]):
+        if delta is None: # без событий достаточно переставить id
+            for src, _, dst in template:
+                new_ids[base + dst * step] = ids[base + src * step]
+            return
+
+        n = self.size
+        moves = delta.moves
+        for src, src2, dst in template:
+            src_cell, dst_cell = base + src * step, base + dst * step
+            to_pos = divmod(dst_cell, n)
+            tile_id = ids[src_cell]
 
+            if src != dst:
+                moves.append(MoveEvent(tile_id, divmod(src_cell, n), to_pos))
+            if src2 >= 0:
+                src2_cell = base + src2 * step
+                tile_id2 = ids[src2_cell]
+                if src2 != dst:
+                    moves.append(MoveEvent(tile_id2, divmod(src2_cell, n), to_pos))
+                delta.merges.append(MergeEvent((tile_id, tile_id2), tile_id, to_pos, VALUES[cells[src_cell] + 1]))
+            new_ids[dst_cell] = tile_id
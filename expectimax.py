@@ -0,0 +1,293 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+
+from collections import OrderedDict
+import time
+
+import bitboard
+import symmetry
+from engine import GameState, line_cache
+
+DIRECTIONS = ("u", "d", "l", "r")
+
+SPAWN_2_PROBABILITY = 0.9 # как в GameEngine._spawn_tile
+MIN_PROBABILITY = 0.0001 # ветки с меньшей вероятностью не раскрываются
+CACHE_LIMIT = 500_000
+FRAME_BUDGET = 0.010 # секунды на выбор хода в GUI (подсказка, автоигра): вместе с отрисовкой укладывается в кадр
+
+# Веса эвристики строки (по показателям степени): пустые клетки, возможные слияния, монотонность, сумма
+LOST_PENALTY = 200000.0
+EMPTY_WEIGHT = 270.0
+MERGES_WEIGHT = 700.0
+MONOTONICITY_POWER = 4.0
+MONOTONICITY_WEIGHT = 47.0
+SUM_POWER = 3.5
+SUM_WEIGHT = 11.0
+
+def line_heuristic(line: bytes | Tuple[int, ...] | List[int]) -> float:
+    empty = 0
+    merges = 0
+    prev = 0
+    counter = 0
+    total = 0.0
+    for e in line:
+        total += e ** SUM_POWER
+        if e == 0:
+            empty += 1
+        elif prev == e:
+            counter += 1
+        else:
+            if counter > 0:
+                merges += 1 + counter
+            counter = 0
+            prev = e
+    if counter > 0:
+        merges += 1 + counter
+
+    mono_left = 0.0
+    mono_right = 0.0
+    for i in range(1, len(line)):
+        a, b = line[i - 1], line[i]
+        if a > b:
+            mono_left += a ** MONOTONICITY_POWER - b ** MONOTONICITY_POWER
+        else:
+            mono_right += b ** MONOTONICITY_POWER - a ** MONOTONICITY_POWER
+
+    return LOST_PENALTY + EMPTY_WEIGHT * empty + MERGES_WEIGHT * merges - MONOTONICITY_WEIGHT * min(mono_left, mono_right) - SUM_WEIGHT * total
+
+_bitboard_heuristic: List[float] = []
+
+def _bitboard_heuristic_table() -> List[float]:
+    if not _bitboard_heuristic:
+        _bitboard_heuristic.extend(line_heuristic([(row >> (4 * i)) & 0xF for i in range(4)]) for row in range(65536))
+    return _bitboard_heuristic
+
+class BitboardPosition:
+    # Операции над упакованной доской 4x4: ходы и оценка без выделения памяти
+    def __init__(self):
+        self.table = _bitboard_heuristic_table()
+
+    def from_state(self, state: GameState) -> Optional[int]:
+        if state.bits is not None:
+            return state.bits
+        return bitboard.encode_cells(state.cells)
+
+    def move(self, board: int, direction: str) -> int:
+        return bitboard.move(board, direction)[0]
+
+    def canonical(self, board: int) -> int:
+        return symmetry.canonical_bits(board)[0]
+
+    def moves(self, board: int) -> Tuple[int, int, int, int]:
+        # Все четыре хода за один проход: строки и транспонированная доска извлекаются один раз
+        left, right, up, down = bitboard.ROW_LEFT, bitboard.ROW_RIGHT, bitboard.COL_UP, bitboard.COL_DOWN
+        r0, r1, r2, r3 = board & 0xFFFF, (board >> 16) & 0xFFFF, (board >> 32) & 0xFFFF, board >> 48
+        t = bitboard.transpose(board)
+        c0, c1, c2, c3 = t & 0xFFFF, (t >> 16) & 0xFFFF, (t >> 32) & 0xFFFF, t >> 48
+        return (
+            up[c0] | (up[c1] << 4) | (up[c2] << 8) | (up[c3] << 12),
+            down[c0] | (down[c1] << 4) | (down[c2] << 8) | (down[c3] << 12),
+            left[r0] | (left[r1] << 16) | (left[r2] << 32) | (left[r3] << 48),
+            right[r0] | (right[r1] << 16) | (right[r2] << 32) | (right[r3] << 48),
+        )
+
+    def evaluate(self, board: int) -> float:
+        table = self.table
+        t = bitboard.transpose(board)
+        return (
+            table[board & 0xFFFF] + table[(board >> 16) & 0xFFFF] + table[(board >> 32) & 0xFFFF] + table[board >> 48]
+            + table[t & 0xFFFF] + table[(t >> 16) & 0xFFFF] + table[(t >> 32) & 0xFFFF] + table[t >> 48]
+        )
+
+    def empty_cells(self, board: int) -> List[int]:
+        return [shift for shift in range(0, 64, 4) if not (board >> shift) & 0xF]
+
+    def spawn(self, board: int, cell: int, exponent: int) -> int:
+        return board | (exponent << cell)
+
+class TuplePosition:
+    # Доска любого размера как плоские bytes показателей (GameState.cells); сдвиги берутся из общего LineCache движка
+    def __init__(self, size: int):
+        self.size = size
+        self.lines = line_cache(size)
+        self.heuristics: Dict[bytes, float] = {}
+        self.symmetry = symmetry.symmetry_tables(size)
+
+    def from_state(self, state: GameState) -> bytes:
+        return state.cells
+
+    def move(self, board: bytes, direction: str) -> bytes:
+        n = self.size
+        get = self.lines.get
+        if direction in ("d", "u"):
+            reverse = direction == "d"
+            cells = bytearray(n * n)
+            for c in range(n):
+                cells[c::n] = get(board[c::n], reverse).values
+            return bytes(cells)
+        reverse = direction == "r"
+        return b"".join([get(board[i:i + n], reverse).values for i in range(0, n * n, n)])
+
+    def canonical(self, board: bytes) -> bytes:
+        return self.symmetry.canonical(board)[0]
+
+    def evaluate(self, board: bytes) -> float:
+        n = self.size
+        line_value = self._line_value
+        return sum(line_value(board[i:i + n]) for i in range(0, n * n, n)) + sum(line_value(board[c::n]) for c in range(n))
+
+    def _line_value(self, line: bytes) -> float:
+        value = self.heuristics.get(line)
+        if value is None:
+            value = line_heuristic(line)
+            self.heuristics[line] = value
+        return value
+
+    def moves(self, board: bytes) -> Tuple[bytes, ...]:
+        return tuple(self.move(board, direction) for direction in DIRECTIONS)
+
+    def empty_cells(self, board: bytes) -> List[int]:
+        return [cell for cell, e in enumerate(board) if not e]
+
+    def spawn(self, board: bytes, cell: int, exponent: int) -> bytes:
+        return board[:cell] + bytes((exponent,)) + board[cell + 1:]
+
+class _SearchTimeout(Exception):
+    pass
+
+def default_depth(size: int) -> int:
+    # Глубина поиска: на больших досках слишком много пустых клеток в узлах случайности.
+    # С time_budget это предел итеративного углубления; начиная с 9x9 (режим больших досок) ход выбирается по оценке позиции после него
+    if size <= 4:
+        return 3
+    return 2 if size <= 8 else 1
+
+class ExpectimaxSolver:
+    def __init__(self, size: int, depth: int | None = None, cache_limit: int = CACHE_LIMIT, time_budget: float | None = None):
+        # time_budget - итеративное углубление до depth, пока укладывается во время; результат последней законченной глубины.
+        # Без него глубина всегда depth и ход не зависит от скорости машины (self-play)
+        self.size = size
+        self.depth = depth if depth is not None else default_depth(size)
+        self.time_budget = time_budget
+        self.deadline: float | None = None
+        self.completed_depth = 0
+        self.cache_limit = cache_limit
+        self.cache: OrderedDict[Tuple[object, int], float] = OrderedDict() # (каноническая доска, оставшаяся глубина) -> оценка
+        self.evaluations: Dict[object, float] = {} # оценки листьев часто повторяются между ветками
+        self.cache_hits = 0
+        self.nodes = 0
+        self.bitboard = BitboardPosition() if size == 4 else None
+        self.tuples = TuplePosition(size)
+
+    def clear(self):
+        # Сброс кэша позиций (новая партия); оценки листьев от отсечения не зависят и остаются
+        self.cache.clear()
+        self.cache_hits = 0
+
+    def best_move(self, state: GameState) -> Optional[str]:
+        position = self.bitboard
+        board = position.from_state(state) if position else None
+        if board is None: # 32768 на доске 4x4 не помещается в 64 бита
+            position = self.tuples
+            board = position.from_state(state)
+        scores = self._score_moves(position, board)
+        if not scores:
+            return None
+        return max(scores, key=scores.get)
+
+    def score_moves(self, state: GameState) -> Dict[str, float]:
+        position = self.bitboard
+        board = position.from_state(state) if position else None
+        if board is None:
+            position = self.tuples
+            board = position.from_state(state)
+        return self._score_moves(position, board)
+
+    def _score_moves(self, position, board) -> Dict[str, float]:
+        self.nodes = 0
+        if self.time_budget is None:
+            self.completed_depth = self.depth
+            return self._score_depth(position, board, self.depth)
+
+        # Глубина 1 - только оценка позиций после хода, она считается всегда; дальше - пока не кончится время
+        self.deadline = time.perf_counter() + self.time_budget
+        scores = self._score_depth(position, board, 1)
+        self.completed_depth = 1
+        try:
+            for depth in range(2, self.depth + 1):
+                scores = self._score_depth(position, board, depth)
+                self.completed_depth = depth
+        except _SearchTimeout: # в кэше только досчитанные узлы, прерванная глубина ничего не портит
+            pass
+        finally:
+            self.deadline = None
+        return scores
+
+    def _score_depth(self, position, board, depth: int) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        for direction, new_board in zip(DIRECTIONS, position.moves(board)):
+            if new_board != board:
+                scores[direction] = self._chance(position, new_board, depth - 1, 1.0)
+        return scores
+
+    def _chance(self, position, board, depth: int, probability: float) -> float:
+        if depth <= 0 or probability < MIN_PROBABILITY:
+            return self._evaluate(position, board)
+
+        key = (position.canonical(board), depth) # оценка не зависит от поворотов и отражений: одна запись на 8 ориентаций
+        cache = self.cache
+        value = cache.get(key)
+        if value is not None:
+            self.cache_hits += 1
+            cache.move_to_end(key)
+            return value
+
+        cells = position.empty_cells(board)
+        if not cells:
+            return self._evaluate(position, board)
+
+        p2 = probability * SPAWN_2_PROBABILITY / len(cells)
+        p4 = probability * (1.0 - SPAWN_2_PROBABILITY) / len(cells)
+        total = 0.0
+        for cell in cells:
+            total += SPAWN_2_PROBABILITY * self._max(position, position.spawn(board, cell, 1), depth, p2)
+            total += (1.0 - SPAWN_2_PROBABILITY) * self._max(position, position.spawn(board, cell, 2), depth, p4)
+        value = total / len(cells)
+
+        cache[key] = value
+        if len(cache) > self.cache_limit:
+            cache.popitem(last=False)
+        return value
+
+    def _evaluate(self, position, board) -> float:
+        value = self.evaluations.get(board)
+        if value is None:
+            if len(self.evaluations) >= self.cache_limit:
+                self.evaluations.clear()
+            value = position.evaluate(board)
+            self.evaluations[board] = value
+        return value
+
+    def _max(self, position, board, depth: int, probability: float) -> float:
+        self.nodes += 1
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise _SearchTimeout
+        best = 0.0
+        if depth <= 1 or probability < MIN_PROBABILITY:
+            # дети - листья: оцениваем сразу, без лишнего вызова _chance
+            evaluations = self.evaluations
+            for new_board in position.moves(board):
+                if new_board != board:
+                    value = evaluations.get(new_board)
+                    if value is None:
+                        value = self._evaluate(position, new_board)
+                    if value > best:
+                        best = value
+            return best
+
+        for new_board in position.moves(board):
+            if new_board != board:
+                value = self._chance(position, new_board, depth - 1, probability)
+                if value > best:
+                    best = value
+        return best
@@ -0,0 +1,226 @@
+from __future__ import annotations
+from typing import List, NamedTuple, Optional
+
+from array import array
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+
+from engine import GameEngine, MoveLog
+from save_load import load_game, save_game
+
+# История сыгранных партий в SQLite: по строке на законченную или брошенную партию.
+# Таблицы рекордов читаются по индексам (LIMIT без сортировки всей таблицы), сводка по размеру доски - одна строка
+# size_stats, которую поддерживает триггер на вставку. Вставки копятся в очереди и пишутся пачками из фонового потока.
+#
+# start - начальное состояние в формате save_load.save_game, stream - сыгранные ходы как MoveLog.records (uint16 LE):
+# партия переигрывается через replay_game без ключевых кадров. seed - сид rng движка в начале партии (NULL для партий,
+# продолженных из сохранения); после отмен спавны идут дальше по тому же rng, поэтому точный повтор дают только start и stream
+
+FLUSH_INTERVAL = 2.0 # секунды, которые вставка может ждать в очереди
+BATCH_SIZE = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    size INTEGER NOT NULL,
+    seed INTEGER,
+    score INTEGER NOT NULL,
+    max_tile INTEGER NOT NULL,
+    moves INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    won INTEGER NOT NULL,
+    abandoned INTEGER NOT NULL,
+    start BLOB NOT NULL,
+    stream BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_by_score ON games (size, score DESC);
+CREATE INDEX IF NOT EXISTS games_by_date ON games (finished_at DESC);
+CREATE INDEX IF NOT EXISTS games_by_tile ON games (size, max_tile DESC, score DESC);
+
+CREATE TABLE IF NOT EXISTS size_stats (
+    size INTEGER PRIMARY KEY,
+    games INTEGER NOT NULL,
+    finished INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    total_score INTEGER NOT NULL,
+    best_score INTEGER NOT NULL,
+    best_tile INTEGER NOT NULL,
+    total_moves INTEGER NOT NULL,
+    total_duration REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS games_stats AFTER INSERT ON games BEGIN
+    INSERT INTO size_stats VALUES (NEW.size, 1, NOT NEW.abandoned, NEW.won, NEW.score, NEW.score, NEW.max_tile, NEW.moves, NEW.duration)
+    ON CONFLICT (size) DO UPDATE SET
+        games = games + 1,
+        finished = finished + NOT NEW.abandoned,
+        wins = wins + NEW.won,
+        total_score = total_score + NEW.score,
+        best_score = max(best_score, NEW.score),
+        best_tile = max(best_tile, NEW.max_tile),
+        total_moves = total_moves + NEW.moves,
+        total_duration = total_duration + NEW.duration;
+END;
+"""
+
+GAME_COLUMNS = "id, size, seed, score, max_tile, moves, duration, finished_at, won, abandoned"
+
+class GameRecord(NamedTuple):
+    id: int
+    size: int
+    seed: Optional[int]
+    score: int
+    max_tile: int
+    moves: int
+    duration: float # секунды
+    finished_at: float # time.time()
+    won: bool
+    abandoned: bool
+
+class SizeStats(NamedTuple):
+    size: int
+    games: int
+    finished: int
+    wins: int
+    total_score: int
+    best_score: int
+    best_tile: int
+    total_moves: int
+    total_duration: float
+
+    @property
+    def average_score(self) -> float:
+        return self.total_score / self.games if self.games else 0.0
+
+def _stream_bytes(records: array) -> bytes:
+    if sys.byteorder != "little":
+        records = array("H", records)
+        records.byteswap()
+    return records.tobytes()
+
+def replay_game(start: bytes, stream: bytes) -> GameEngine:
+    # Движок в конце записанной партии (с полным журналом ходов)
+    state, _ = load_game(start)
+    records = array("H")
+    records.frombytes(stream)
+    if sys.byteorder != "little":
+        records.byteswap()
+    engine = GameEngine(state.size)
+    engine.set_state(state)
+    for code in records:
+        engine.play_record(*MoveLog.decode(code))
+    return engine
+
+class GameHistory:
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL, batch_size: int = BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._reader = sqlite3.connect(path) # чтение - в потоке интерфейса; запись - только из фонового потока
+        self._reader.execute("PRAGMA journal_mode=WAL") # чтение не ждет пишущую транзакцию
+        self._reader.executescript(SCHEMA)
+
+        self._started: weakref.WeakKeyDictionary[MoveLog, float] = weakref.WeakKeyDictionary() # журнал ходов партии -> начало
+        self._recorded: weakref.WeakSet[MoveLog] = weakref.WeakSet()
+        self.inserted = 0
+        self.batches = 0
+
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name="game-history", daemon=True)
+        self._writer.start()
+
+    def track(self, log: MoveLog):
+        # Начало партии для подсчета длительности; повторный вызов для той же партии ничего не меняет
+        self._started.setdefault(log, time.time())
+
+    def finish(self, engine: GameEngine, abandoned: bool = False) -> bool:
+        # Ставит партию движка в очередь на запись; партия без ходов или уже записанная пропускается
+        state, log = engine.state, engine.log
+        if not log.position or log in self._recorded:
+            return False
+        self._recorded.add(log)
+        now = time.time()
+        started = self._started.get(log, now)
+        initial = log.keyframes[0]
+        max_exponent = max(state.cells)
+        self._queue.put((
+            state.size, engine.random_seed, state.score, 1 << max_exponent if max_exponent else 0, log.position,
+            now - started, now, state.game_won, abandoned,
+            save_game(initial, MoveLog(initial)), _stream_bytes(log.records[:log.position]),
+        ))
+        return True
+
+    def top_scores(self, size: int, limit: int = 10) -> List[GameRecord]:
+        return self._games(f"SELECT {GAME_COLUMNS} FROM games WHERE size = ? ORDER BY score DESC LIMIT ?", (size, limit))
+
+    def top_tiles(self, size: int, limit: int = 10) -> List[GameRecord]:
+        return self._games(f"SELECT {GAME_COLUMNS} FROM games WHERE size = ? ORDER BY max_tile DESC, score DESC LIMIT ?", (size, limit))
+
+    def recent(self, limit: int = 10) -> List[GameRecord]:
+        return self._games(f"SELECT {GAME_COLUMNS} FROM games ORDER BY finished_at DESC LIMIT ?", (limit,))
+
+    def stats(self, size: int) -> SizeStats:
+        row = self._reader.execute("SELECT * FROM size_stats WHERE size = ?", (size,)).fetchone()
+        return SizeStats(*row) if row else SizeStats(size, 0, 0, 0, 0, 0, 0, 0, 0.0)
+
+    def replay(self, game_id: int) -> GameEngine:
+        row = self._reader.execute("SELECT start, stream FROM games WHERE id = ?", (game_id,)).fetchone()
+        if row is None:
+            raise KeyError(game_id)
+        return replay_game(*row)
+
+    def _games(self, query: str, args: tuple) -> List[GameRecord]:
+        rows = self._reader.execute(query, args).fetchall()
+        return [GameRecord(*row[:8], bool(row[8]), bool(row[9])) for row in rows]
+
+    def flush(self):
+        # Ждет, пока все поставленные в очередь партии окажутся в базе
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        self._reader.close()
+
+    def _run(self):
+        connection = sqlite3.connect(self.path)
+        batch = []
+        events = []
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self.flush_interval if batch else None)
+            except queue.Empty:
+                item = False # очередь затихла: пишем накопленное
+            if item is None:
+                stop = True
+            elif isinstance(item, threading.Event):
+                events.append(item)
+            elif item is not False:
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+            if batch:
+                with connection: # одна транзакция на пачку
+                    connection.executemany(
+                        "INSERT INTO games (size, seed, score, max_tile, moves, duration, finished_at, won, abandoned, start, stream) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        batch,
+                    )
+                self.inserted += len(batch)
+                self.batches += 1
+                batch = []
+            for event in events:
+                event.set()
+            events = []
+        connection.close()
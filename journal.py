@@ -0,0 +1,246 @@
+from __future__ import annotations
+from typing import List, Optional, Tuple
+
+from array import array
+import os
+import queue
+import threading
+import time
+import zlib
+
+from engine import GameEngine, GameState, MoveLog
+from save_load import _read_varint, _varint, load_game, save_game
+
+# Журнал партии на диске, по файлу на размер доски: снимок (save_load.save_game) и дописываемый хвост событий после него.
+# Каждое событие - несколько байт. Поток интерфейса только ставит события и снимки в очередь; файлы пишет фоновый поток:
+# события - сразу (без буфера процесса), fsync - пачками. Когда хвост разрастается, он сворачивается в новый снимок.
+# Снимок и журнал помечены поколением: если программа упала между записью снимка и созданием нового журнала,
+# старый журнал с прежним поколением просто не применяется.
+#
+# Событие: байт вида, varint-аргументы, байт контрольной суммы (младший байт crc32 предыдущих байт события).
+#   MOVE index code - ход с номером index в журнале ходов (MoveLog.records[index] = code); ходы для повтора дальше него отбрасываются
+#   SEEK position - переход по истории (undo, redo, seek)
+
+SNAPSHOT_MAGIC = b"2048S"
+JOURNAL_MAGIC = b"2048J"
+VERSION = 1
+
+MOVE, SEEK = 1, 2
+_OPEN, _SNAPSHOT = 0, 1 # задания фонового потока, кроме байт событий
+COMPACT_AFTER = 1024 # событий в хвосте до сворачивания в снимок
+SYNC_INTERVAL = 1.0 # секунды между fsync хвоста
+
+def _event(kind: int, *args: int) -> bytes:
+    body = bytes((kind,)) + b"".join(map(_varint, args))
+    return body + bytes((zlib.crc32(body) & 0xFF,))
+
+def _read_events(data: bytes, pos: int) -> Tuple[List[Tuple[int, ...]], int]:
+    # События до конца файла или до первого испорченного (недописанного при падении); второе значение - конец целых событий
+    events: List[Tuple[int, ...]] = []
+    while pos < len(data):
+        start = pos
+        try:
+            kind = data[pos]
+            args = []
+            pos += 1
+            for _ in range({MOVE: 2, SEEK: 1}[kind]):
+                value, pos = _read_varint(data, pos)
+                args.append(value)
+            check = data[pos]
+        except (IndexError, KeyError):
+            return events, start
+        if check != zlib.crc32(data[start:pos]) & 0xFF:
+            return events, start
+        pos += 1
+        events.append((kind, *args))
+    return events, pos
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+class GameJournal:
+    def __init__(self, directory: str, size: int):
+        self.size = size
+        self.snapshot_path = os.path.join(directory, f"game_{size}x{size}.snapshot")
+        self.journal_path = os.path.join(directory, f"game_{size}x{size}.journal")
+        os.makedirs(directory, exist_ok=True)
+
+        self.generation = 0
+        self.events = 0 # событий в хвосте после снимка
+        self.compactions = 0
+        self.error: Optional[OSError] = None # последняя ошибка записи в фоновом потоке
+        self._log: Optional[MoveLog] = None
+        self._records = array("H") # журнал ходов, каким его восстановит хвост
+        self._position = 0
+
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name=f"journal-{size}x{size}", daemon=True)
+        self._writer.start()
+
+    def recover(self) -> Optional[Tuple[GameState, MoveLog]]:
+        # Снимок плюс уцелевший хвост; None - сохраненной партии нет или снимок не читается
+        try:
+            with open(self.snapshot_path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC or data[len(SNAPSHOT_MAGIC)] != VERSION:
+                return None
+            generation, pos = _read_varint(data, len(SNAPSHOT_MAGIC) + 1)
+            state, log = load_game(data[pos:])
+        except (ValueError, IndexError):
+            return None
+        self.generation = generation
+
+        events, end = self._read_tail(generation)
+        engine = GameEngine(self.size)
+        engine.set_state(state, log)
+        try:
+            for event in events:
+                if event[0] == MOVE:
+                    _, index, code = event
+                    if engine.log.position != index:
+                        engine.seek(index)
+                    engine.play_record(*MoveLog.decode(code))
+                else:
+                    engine.seek(event[1])
+        except (ValueError, IndexError): # хвост не сходится со снимком: остается то, что удалось применить, sync начнет новый снимок
+            return engine.state, engine.log
+
+        if end:
+            # Дальнейшие события дописываются в тот же журнал; недописанное при падении событие отрезается
+            self._queue.put((_OPEN, end))
+            self.events = len(events)
+            self._log = engine.log
+            self._records = array("H", engine.log.records)
+            self._position = engine.log.position
+        return engine.state, engine.log
+
+    def _read_tail(self, generation: int) -> Tuple[List[Tuple[int, ...]], int]:
+        # События хвоста этого поколения и конец последнего целого события (0 - журнал не подходит к снимку)
+        try:
+            with open(self.journal_path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return [], 0
+        try:
+            if data[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC or data[len(JOURNAL_MAGIC)] != VERSION:
+                return [], 0
+            journal_generation, pos = _read_varint(data, len(JOURNAL_MAGIC) + 1)
+        except IndexError:
+            return [], 0
+        if journal_generation != generation: # падение между записью снимка и нового журнала: снимок уже содержит этот хвост
+            return [], 0
+        return _read_events(data, pos)
+
+    def start(self, state: GameState, log: MoveLog):
+        # Новый снимок (новая партия, загрузка, сворачивание хвоста) и пустой журнал следующего поколения.
+        # Сериализация и запись - в фоновом потоке: здесь только копия журнала ходов (2 байта на ход и ссылки на ключевые кадры)
+        self.generation += 1
+        for keyframe in log.keyframes: # ids состояний без них собираются здесь, а не одновременно из двух потоков
+            keyframe.ids
+        state.ids
+        self._queue.put((_SNAPSHOT, self.generation, state, log.copy()))
+        self.events = 0
+        self._log = log
+        self._records = array("H", log.records)
+        self._position = log.position
+
+    def sync(self, state: GameState, log: MoveLog):
+        # Дописывает изменения журнала ходов с прошлого вызова; вызывается после каждой команды.
+        # Стоимость пропорциональна числу новых ходов, а не длине партии
+        if log is not self._log:
+            self.start(state, log)
+            return
+
+        records = self._records
+        position = self._position
+        events = []
+        for index in range(self._position, log.position):
+            code = log.records[index]
+            if index < len(records) and records[index] == code:
+                continue # повтор отмененного хода
+            del records[index:]
+            records.append(code)
+            events.append(_event(MOVE, index, code))
+            position = index + 1
+        if len(records) != len(log.records) or records[-1:] != log.records[-1:]:
+            self.start(state, log) # изменение между вызовами, которое не выражается событиями хвоста (например отмена и ход сразу)
+            return
+        if position != log.position:
+            events.append(_event(SEEK, log.position))
+        self._position = log.position
+        if not events:
+            return
+
+        self._queue.put(b"".join(events))
+        self.events += len(events)
+        if self.events >= COMPACT_AFTER:
+            self.compactions += 1
+            self.start(state, log)
+
+    def flush(self):
+        # Ждет, пока все поставленное в очередь окажется на диске (с fsync)
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        # Хвост не сворачивается: закрытие не зависит от длины партии, следующий запуск переиграет не больше COMPACT_AFTER событий.
+        # Недописанные события и снимок записываются до возврата
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _run(self):
+        file = None
+        dirty = False
+        synced_at = time.monotonic()
+        while True:
+            timeout = max(0.0, synced_at + SYNC_INTERVAL - time.monotonic()) if dirty else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False # время fsync
+            if item is None:
+                break
+            try:
+                if isinstance(item, bytes):
+                    if file is not None:
+                        file.write(item)
+                        dirty = True
+                elif isinstance(item, threading.Event):
+                    if dirty:
+                        os.fsync(file.fileno())
+                        dirty = False
+                    item.set()
+                elif item is not False:
+                    if file is not None:
+                        file.close()
+                        file = None
+                    dirty = False
+                    if item[0] == _OPEN:
+                        file = open(self.journal_path, "r+b", buffering=0)
+                        file.truncate(item[1])
+                        file.seek(item[1])
+                    else:
+                        _, generation, state, log = item
+                        _write_atomic(self.snapshot_path, SNAPSHOT_MAGIC + bytes((VERSION,)) + _varint(generation) + save_game(state, log))
+                        _write_atomic(self.journal_path, JOURNAL_MAGIC + bytes((VERSION,)) + _varint(generation))
+                        file = open(self.journal_path, "ab", buffering=0)
+                if dirty and time.monotonic() >= synced_at + SYNC_INTERVAL:
+                    os.fsync(file.fileno())
+                    dirty = False
+                    synced_at = time.monotonic()
+            except OSError as error: # диск полон, нет прав: партия продолжается, ошибка видна в error
+                self.error = error
+        if file is not None:
+            if dirty:
+                os.fsync(file.fileno())
+            file.close()
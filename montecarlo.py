@@ -0,0 +1,99 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+import os
+import random
+import time
+
+from engine import GameEngine, GameState, MASK_DIRECTIONS
+
+ROLLOUT_MOVES = 64 # горизонт роллаута по умолчанию
+
+def rollout(engine: GameEngine, rng: random.Random, max_moves: int | None = None) -> int:
+    # Случайная партия до конца игры или до max_moves ходов; ходы и спавн - через обычный GameEngine.move, правила не расходятся.
+    # События анимации роллауту не нужны, поэтому ходы идут без них
+    moves = 0
+    while not engine.state.game_over and (max_moves is None or moves < max_moves):
+        engine.move(rng.choice(MASK_DIRECTIONS[engine.available_moves()]), record_delta=False) # пока игра не окончена, ход всегда есть
+        moves += 1
+    return engine.state.score
+
+def run_rollouts(size: int, state: GameState, direction: str, count: int, seed: int, time_limit: float | None, max_moves: int | None = ROLLOUT_MOVES) -> Tuple[int, int]:
+    # Время проверяется только между роллаутами: каждый сэмпл - полный роллаут с одним горизонтом, и средние сравнимы
+    deadline = time.perf_counter() + time_limit if time_limit is not None else None
+    rng = random.Random(seed)
+    total = 0
+    done = 0
+    while done < count and (done == 0 or deadline is None or time.perf_counter() < deadline):
+        engine = GameEngine(size, random_seed=rng.getrandbits(32))
+        engine.set_state(state)
+        if not engine.move(direction, record_delta=False)[1]:
+            break
+        total += rollout(engine, rng, max_moves) - state.score
+        done += 1
+    return total, done
+
+class MonteCarloSolver:
+    def __init__(self, size: int, rollouts: int = 100, time_budget: float | None = 0.5, workers: int | None = None, max_moves: int | None = ROLLOUT_MOVES, random_seed: int | None = None):
+        # time_budget=None - всегда ровно rollouts роллаутов на ход (воспроизводимо); max_moves=None - роллауты до конца игры
+        self.size = size
+        self.rollouts = rollouts
+        self.time_budget = time_budget
+        self.workers = workers or os.cpu_count() or 1
+        self.max_moves = max_moves
+        self.rng = random.Random(random_seed)
+        self.executor: Optional[Executor] = None
+        self._probe = GameEngine(size) # только для списка допустимых ходов
+
+    def best_move(self, state: GameState) -> Optional[str]:
+        scores = self.score_moves(state)
+        if not scores:
+            return None
+        return max(scores, key=scores.get)
+
+    def score_moves(self, state: GameState) -> Dict[str, float]:
+        # GameState не ссылается на историю: в процесс уходят только клетки, id и счет
+        legal = MASK_DIRECTIONS[self._probe.available_moves(state)]
+        if not legal:
+            return {}
+
+        # Каждое направление делится на пачки по числу процессов; бюджет времени делится поровну между пачками,
+        # чтобы первое направление не съело его целиком
+        chunks = max(1, min(self.rollouts, self.workers))
+        per_chunk = -(-self.rollouts // chunks)
+        time_limit = self.time_budget * self.workers / (chunks * len(legal)) if self.time_budget is not None else None
+        jobs: List[Tuple[str, tuple]] = []
+        for direction in legal:
+            for _ in range(chunks):
+                jobs.append((direction, (self.size, state, direction, per_chunk, self.rng.getrandbits(32), time_limit, self.max_moves)))
+
+        totals = {d: 0 for d in legal}
+        counts = {d: 0 for d in legal}
+        if self.workers == 1:
+            results = [run_rollouts(*args) for _, args in jobs]
+        else:
+            executor = self._get_executor()
+            futures = [executor.submit(run_rollouts, *args) for _, args in jobs]
+            results = [future.result() for future in futures]
+
+        for (direction, _), (total, done) in zip(jobs, results):
+            totals[direction] += total
+            counts[direction] += done
+        return {d: totals[d] / counts[d] for d in legal if counts[d]}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def _get_executor(self) -> Executor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def __enter__(self) -> MonteCarloSolver:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+from typing import Any, Dict, Optional
+
+import threading
+import time
+
+from PySide6.QtCore import QSettings
+
+DEBOUNCE = 0.5 # секунды тишины после последнего изменения до записи в QSettings
+MAX_DELAY = 5.0 # не дольше этого после первого несброшенного изменения, даже если изменения идут непрерывно (автоигра)
+
+class PersistenceService:
+    # Отложенная запись настроек (лучшие счета, громкость, размер доски) из фонового потока.
+    # set() только запоминает значение: серия изменений (новый рекорд почти на каждом ходу) уходит в бэкенд QSettings
+    # одной пачкой после DEBOUNCE секунд тишины (но не позже MAX_DELAY) и при close(). value() видит записанное, даже если оно еще не сброшено.
+    # Партии сюда не входят: они пишутся журналом (journal.GameJournal), у которого свой fsync в фоне
+    def __init__(self, settings: Optional[QSettings], debounce: float = DEBOUNCE, max_delay: float = MAX_DELAY):
+        self.settings = settings
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._values: Dict[str, Any] = {} # все значения, записанные через set(): чтение без обращения к бэкенду
+        self._pending: Dict[str, Any] = {}
+        self._changed_at = 0.0
+        self._first_change_at = 0.0
+
+        self.flushes = 0
+        self.writes = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+        self._lock = threading.Lock() # порядок записей и доступ к settings
+        self._wakeup = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="settings-writer", daemon=True)
+        self._worker.start()
+
+    def value(self, key: str, default: Any = None, type: Optional[type] = None) -> Any:
+        if key in self._values:
+            return self._values[key]
+        if self.settings is None:
+            return default
+        with self._lock:
+            return self.settings.value(key, default, type=type) if type is not None else self.settings.value(key, default)
+
+    def set(self, key: str, value: Any):
+        self._values[key] = value
+        with self._wakeup:
+            if not self._pending:
+                self._first_change_at = time.monotonic()
+            self._pending[key] = value
+            self._changed_at = time.monotonic()
+            self._wakeup.notify()
+
+    def flush(self):
+        # Синхронный сброс накопленного (закрытие окна, тесты)
+        self._drain()
+
+    def close(self):
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+        self._worker.join()
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "flushes": self.flushes,
+            "writes": self.writes,
+            "pending": len(self._pending),
+            "last_latency_ms": self.last_latency * 1e3,
+            "max_latency_ms": self.max_latency * 1e3,
+            "mean_latency_ms": self.total_latency / self.flushes * 1e3 if self.flushes else 0.0,
+        }
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._closed:
+                    if self._pending:
+                        deadline = min(self._changed_at + self.debounce, self._first_change_at + self.max_delay)
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._wakeup.wait(remaining)
+                    else:
+                        self._wakeup.wait()
+                if self._closed: # остаток сбросит close() в своем потоке
+                    return
+            self._drain()
+
+    def _drain(self):
+        # Забор накопленного и запись - под одной блокировкой, чтобы более старая пачка не легла поверх новой
+        with self._lock:
+            with self._wakeup:
+                pending, self._pending = self._pending, {}
+            if not pending or self.settings is None:
+                return
+            start = time.perf_counter()
+            for key, value in pending.items():
+                self.settings.setValue(key, value)
+            self.settings.sync()
+            latency = time.perf_counter() - start
+            self.flushes += 1
+            self.writes += len(pending)
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
@@ -1,7 +1,162 @@
-from engine import GameState, DeltaEvent
+from array import array
+from itertools import compress
+from operator import or_
+import sys
 
-def save_game(state: GameState, history: list[GameState], delta_history: list[list[DeltaEvent]]) -> dict:
-    def unpack_state(state: GameState) -> dict:    
+from engine import GameEngine, GameState, MoveLog
+
+# Двоичный формат сохранения (версия 1):
+#   MAGIC, байт версии, varint: size, interval, position, число записей журнала, число ключевых кадров;
+#   записи журнала - uint16 little-endian, как MoveLog.records;
+#   текущее состояние, затем ключевые кадры. Состояние: байт флагов, varint score, varint next_id,
+#   показатели клеток по две в байте (младшая тетрада - первая клетка) и id занятых клеток varint'ами.
+# Старые сохранения - словари (save_game_dict) - load_game читает по-прежнему
+
+MAGIC = b"2048"
+VERSION = 1
+
+GAME_OVER, GAME_WON, WIDE_CELLS, ALL_IDS = 1, 2, 4, 8 # флаги состояния
+# WIDE_CELLS - показатель больше 15, клетки пишутся по байту; ALL_IDS - у пустых клеток есть id, пишутся id всех клеток
+
+_HIGH_NIBBLE = bytes((b << 4) & 0xFF for b in range(256)) # показатель -> он же в старшей тетраде
+_LOW = bytes(b & 0xF for b in range(256))
+_HIGH = bytes(b >> 4 for b in range(256))
+_EMPTY = bytes([1] + [0] * 255) # показатель -> 1 для пустой клетки
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    _write_varint(out, value)
+    return bytes(out)
+
+_SHORT_VARINTS = [_varint(value) for value in range(1 << 14)] # все одно- и двухбайтовые varint: id тайлов обычно меньше 16384
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _write_state(out: bytearray, state: GameState):
+    cells = state.cells
+    ids = state.ids
+    wide = max(cells) > 15
+    all_ids = any(compress(ids, cells.translate(_EMPTY)))
+    out.append(state.game_over * GAME_OVER | state.game_won * GAME_WON | wide * WIDE_CELLS | all_ids * ALL_IDS)
+    _write_varint(out, state.score)
+    _write_varint(out, state.next_id)
+
+    if wide:
+        out += cells
+    else:
+        if len(cells) % 2:
+            cells += b"\0"
+        out += bytes(map(or_, cells[0::2], cells[1::2].translate(_HIGH_NIBBLE)))
+
+    written = ids if all_ids else list(compress(ids, state.cells))
+    if max(written, default=0) < len(_SHORT_VARINTS):
+        out += b"".join(map(_SHORT_VARINTS.__getitem__, written))
+    else:
+        for tile_id in written:
+            _write_varint(out, tile_id)
+
+def _read_state(data: bytes, pos: int, size: int) -> tuple[GameState, int]:
+    count = size * size
+    flags = data[pos]
+    score, pos = _read_varint(data, pos + 1)
+    next_id, pos = _read_varint(data, pos)
+
+    if flags & WIDE_CELLS:
+        cells = bytes(data[pos:pos + count])
+        pos += count
+    else:
+        packed = data[pos:pos + (count + 1) // 2]
+        pos += len(packed)
+        unpacked = bytearray(2 * len(packed))
+        unpacked[0::2] = packed.translate(_LOW)
+        unpacked[1::2] = packed.translate(_HIGH)
+        cells = bytes(unpacked[:count])
+    if len(cells) != count:
+        raise ValueError("save data is truncated")
+
+    ids = array("I", bytes(4 * count))
+    for cell in (range(count) if flags & ALL_IDS else compress(range(count), cells)):
+        byte = data[pos]
+        if byte < 0x80:
+            ids[cell] = byte
+            pos += 1
+        else:
+            ids[cell], pos = _read_varint(data, pos)
+
+    state = GameState(size, cells, ids, score, bool(flags & GAME_OVER), bool(flags & GAME_WON), next_id)
+    return state, pos
+
+def save_game(state: GameState, log: MoveLog) -> bytes:
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    for value in (state.size, log.interval, log.position, len(log.records), len(log.keyframes)):
+        _write_varint(out, value)
+
+    records = log.records
+    if sys.byteorder != "little":
+        records = array("H", records)
+        records.byteswap()
+    out += records.tobytes()
+
+    _write_state(out, state)
+    for keyframe in log.keyframes:
+        _write_state(out, keyframe)
+    return bytes(out)
+
+def _load_binary(data: bytes) -> tuple[GameState, MoveLog]:
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a 2048 save")
+    version = data[len(MAGIC)]
+    if version != VERSION:
+        raise ValueError(f"unsupported save version {version}")
+
+    pos = len(MAGIC) + 1
+    header = []
+    for _ in range(5):
+        value, pos = _read_varint(data, pos)
+        header.append(value)
+    size, interval, position, record_count, keyframe_count = header
+
+    records = array("H")
+    records.frombytes(data[pos:pos + 2 * record_count])
+    if len(records) != record_count:
+        raise ValueError("save data is truncated")
+    if sys.byteorder != "little":
+        records.byteswap()
+    pos += 2 * record_count
+
+    state, pos = _read_state(data, pos, size)
+    keyframes: list[GameState] = []
+    for _ in range(keyframe_count):
+        keyframe, pos = _read_state(data, pos, size)
+        keyframes.append(keyframe)
+    if not keyframes:
+        raise ValueError("move log has no keyframes")
+
+    log = MoveLog(keyframes[0], interval=interval)
+    log.keyframes = keyframes
+    log.records = records
+    log.position = position
+    return state, log
+
+def save_game_dict(state: GameState, log: MoveLog) -> dict:
+    # Прежний формат: словарь с матрицами досок, хранился в QSettings как вариант
+    def unpack_state(state: GameState) -> dict:
         return {
             "board": state.board,
             "id_board": state.id_board,
@@ -11,19 +166,28 @@ def save_game(state: GameState, history: list[GameState], delta_history: list[li
             "next_id": state.next_id,
         }
     cur_state_dict = unpack_state(state)
-    history_state_dict: list[dict] = []
-    for state in history:
-        history_state_dict.append(unpack_state(state))
+    keyframes_dict: list[dict] = []
+    for keyframe in log.keyframes:
+        keyframes_dict.append(unpack_state(keyframe))
 
     return {
         "state": cur_state_dict,
-        "history": history_state_dict,
-        "delta_history": delta_history,
+        "log": {
+            "interval": log.interval,
+            "position": log.position,
+            "records": log.records.tolist(),
+            "keyframes": keyframes_dict,
+        },
     }
 
-def load_game(data: dict) -> tuple[GameState, list[GameState], list[list[DeltaEvent]]]:
+def load_game(data: bytes | dict) -> tuple[GameState, MoveLog]:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        state, log = _load_binary(bytes(data))
+        _check_log(log)
+        return state, log
+
     def pack_state(state_dict: dict) -> GameState:
-        return GameState(
+        return GameState.from_boards(
             board=state_dict["board"],
             id_board=state_dict["id_board"],
             score=state_dict["score"],
@@ -32,9 +196,26 @@ def load_game(data: dict) -> tuple[GameState, list[GameState], list[list[DeltaEv
             next_id=state_dict["next_id"],
         )
     state = pack_state(data["state"])
-    history: list[GameState] = []
-    for state_dict in data["history"]:
-        history.append(pack_state(state_dict))
-    delta_history: list[list[DeltaEvent]] = data["delta_history"]
 
-    return state, history, delta_history
\ No newline at end of file
+    if "log" not in data: # старый формат: последние 10 состояний и события ходов
+        history: list[GameState] = []
+        for state_dict in data["history"]:
+            history.append(pack_state(state_dict))
+        log = GameEngine(state.size).log_from_states(history + [state])
+        return state, log
+
+    log_dict = data["log"]
+    keyframes: list[GameState] = []
+    for state_dict in log_dict["keyframes"]:
+        keyframes.append(pack_state(state_dict))
+    log = MoveLog(keyframes[0], interval=log_dict["interval"])
+    log.keyframes = keyframes
+    log.records.extend(log_dict["records"])
+    log.position = log_dict.get("position", len(log.records))
+    _check_log(log)
+
+    return state, log
+
+def _check_log(log: MoveLog):
+    if len(log.keyframes) != len(log.records) // log.interval + 1 or not 0 <= log.position <= len(log.records):
+        raise ValueError("move log keyframes do not match its records")
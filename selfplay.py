@@ -0,0 +1,129 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+
+from engine import GameEngine
+from strategies import STRATEGIES
+
+RESULT_FIELDS = ["game", "seed", "size", "strategy", "score", "max_tile", "moves", "won", "wall_time"]
+
+def play_game(size: int, strategy: str, seed: int, max_moves: int | None = None) -> Dict[str, Any]:
+    # Спавн тайлов зависит только от сида движка, выбор хода - от отдельного rng стратегии
+    engine = GameEngine(size, random_seed=seed)
+    choose = STRATEGIES[strategy]
+    rng = random.Random(f"{seed}:{strategy}")
+    moves = 0
+
+    start = time.perf_counter()
+    while not engine.state.game_over and (max_moves is None or moves < max_moves):
+        direction = choose(engine, rng)
+        if direction is None:
+            break
+        _, moved, _ = engine.move(direction, record_delta=False) # события анимации партии без GUI не нужны
+        if not moved:
+            break
+        moves += 1
+    wall_time = time.perf_counter() - start
+
+    state = engine.state
+    return {
+        "seed": seed,
+        "size": size,
+        "strategy": strategy,
+        "score": state.score,
+        "max_tile": max(max(row) for row in state.board),
+        "moves": moves,
+        "won": state.game_won,
+        "wall_time": round(wall_time, 6),
+    }
+
+def _play_game_args(args: tuple) -> Dict[str, Any]:
+    return play_game(*args)
+
+def run_games(games: int, size: int, strategy: str, base_seed: int = 0, workers: int | None = None, max_moves: int | None = None) -> Iterator[Dict[str, Any]]:
+    jobs = [(size, strategy, base_seed + game, max_moves) for game in range(games)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        results = map(_play_game_args, jobs)
+        for game, result in enumerate(results):
+            yield {"game": game, **result}
+        return
+
+    chunksize = max(1, games // (workers * 8)) # мелкие пачки - равномерная загрузка ядер без лишних пересылок
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for game, result in enumerate(executor.map(_play_game_args, jobs, chunksize=chunksize)):
+            yield {"game": game, **result}
+
+class ResultWriter:
+    def __init__(self, path: str | None, fmt: str):
+        self.fmt = fmt
+        self.file = open(path, "w", newline="", encoding="utf-8") if path else None
+        self.csv_writer = None
+        if self.file and fmt == "csv":
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS)
+            self.csv_writer.writeheader()
+
+    def write(self, result: Dict[str, Any]):
+        if self.file is None:
+            return
+        if self.csv_writer:
+            self.csv_writer.writerow(result)
+        else:
+            self.file.write(json.dumps(result) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless 2048 self-play")
+    parser.add_argument("-n", "--games", type=int, default=100)
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="greedy")
+    parser.add_argument("--seed", type=int, default=0, help="base seed, game i uses seed + i")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--max-moves", type=int, default=None)
+    parser.add_argument("-o", "--output", default=None, help="stream per-game results to this file")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default=None, help="output format (default: from file extension)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.output and args.output.endswith(".csv") else "jsonl")
+    writer = ResultWriter(args.output, fmt)
+
+    total_moves = 0
+    total_score = 0
+    best_tile = 0
+    wins = 0
+    start = time.perf_counter()
+    try:
+        for result in run_games(args.games, args.size, args.strategy, args.seed, args.workers, args.max_moves):
+            writer.write(result)
+            total_moves += result["moves"]
+            total_score += result["score"]
+            best_tile = max(best_tile, result["max_tile"])
+            wins += result["won"]
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    games = max(1, args.games)
+    print(
+        f"{args.games} games of {args.size}x{args.size} with '{args.strategy}' in {elapsed:.2f}s: "
+        f"{args.games / elapsed:.1f} games/s, {total_moves / elapsed:.0f} moves/s | "
+        f"mean score {total_score / games:.0f}, best tile {best_tile}, won {wins}",
+        file=sys.stderr,
+    )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
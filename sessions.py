@@ -0,0 +1,52 @@
+from __future__ import annotations
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from collections import OrderedDict
+
+from BoardHolder import BoardHolder
+from engine import GameEngine
+from journal import GameJournal
+
+SESSION_LIMIT = 4 # размеров доски, которые держатся в памяти; 32x32 с длинным журналом ходов занимает мегабайты
+
+class GameSession(NamedTuple):
+    # Живая партия одного размера: движок с журналом ходов, журнал на диске и готовые виджеты доски
+    engine: GameEngine
+    journal: GameJournal
+    board_holder: BoardHolder
+
+class SessionCache:
+    # Сессии по размеру доски в порядке последнего использования: переключение размера - замена ссылок, без сериализации
+    # и пересоздания виджетов. Сверх limit вытесняется самая давняя сессия (ее журнал уже записан на диск)
+    def __init__(self, limit: int = SESSION_LIMIT, on_evict: Optional[Callable[[GameSession], None]] = None):
+        self.limit = max(1, limit)
+        self.on_evict = on_evict
+        self._sessions: OrderedDict[int, GameSession] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, size: int) -> Optional[GameSession]:
+        session = self._sessions.get(size)
+        if session is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._sessions.move_to_end(size)
+        return session
+
+    def put(self, size: int, session: GameSession):
+        self._sessions[size] = session
+        self._sessions.move_to_end(size)
+        while len(self._sessions) > self.limit:
+            _, evicted = self._sessions.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(evicted)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, size: int) -> bool:
+        return size in self._sessions
+
+    def __iter__(self) -> Iterator[GameSession]:
+        return iter(list(self._sessions.values()))
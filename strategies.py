@@ -0,0 +1,113 @@
+from __future__ import annotations
+from typing import Callable, Dict, List, Tuple
+
+import random
+
+from engine import DIRECTIONS, GameEngine, MASK_DIRECTIONS, MoveLog
+from expectimax import ExpectimaxSolver
+from montecarlo import MonteCarloSolver
+from tablebase import Tablebase, open_default
+
+CORNER_ORDER = ("d", "l", "r", "u") # держим крупные тайлы в левом нижнем углу
+
+Board = bytes # показатели степени по клеткам, как GameState.cells
+Strategy = Callable[[GameEngine, random.Random], str | None]
+
+def _slide(engine: GameEngine, board: Board, direction: str) -> Tuple[Board, int, bool]:
+    # Ход без спавна и без записи в историю; id тайлов стратегиям не нужны
+    return engine.simulate_move(board, direction)
+
+def _empty_cells(board: Board) -> int:
+    return board.count(0)
+
+def legal_moves(engine: GameEngine) -> List[str]:
+    return list(MASK_DIRECTIONS[engine.available_moves()])
+
+def random_strategy(engine: GameEngine, rng: random.Random) -> str | None:
+    moves = legal_moves(engine)
+    return rng.choice(moves) if moves else None
+
+def greedy_strategy(engine: GameEngine, rng: random.Random) -> str | None:
+    best = None
+    best_key = None
+    for direction in DIRECTIONS:
+        new_board, score_gain, moved = _slide(engine, engine.state.cells, direction)
+        if not moved:
+            continue
+        key = (score_gain, _empty_cells(new_board))
+        if best_key is None or key > best_key:
+            best, best_key = direction, key
+    return best
+
+def corner_strategy(engine: GameEngine, rng: random.Random) -> str | None:
+    board = engine.state.cells
+    for direction in CORNER_ORDER:
+        if _slide(engine, board, direction)[2]:
+            return direction
+    return None
+
+def search_strategy(engine: GameEngine, rng: random.Random) -> str | None:
+    # Двухходовой перебор без учета спавна: очки за оба хода плюс бонус за пустые клетки
+    board = engine.state.cells
+    best = None
+    best_value = None
+    for direction in DIRECTIONS:
+        new_board, score_gain, moved = _slide(engine, board, direction)
+        if not moved:
+            continue
+        follow_up = 0
+        for next_direction in DIRECTIONS:
+            next_board, next_gain, next_moved = _slide(engine, new_board, next_direction)
+            if next_moved:
+                follow_up = max(follow_up, next_gain + 16 * _empty_cells(next_board))
+        value = score_gain + follow_up + 16 * _empty_cells(new_board)
+        if best_value is None or value > best_value:
+            best, best_value = direction, value
+    return best
+
+_solvers: Dict[int, Tuple[MoveLog, ExpectimaxSolver]] = {} # решатель на размер в процессе и партия, которую он ведет
+
+def expectimax_strategy(engine: GameEngine, rng: random.Random) -> str | None:
+    # Значения в кэше зависят от отсечения по вероятности в момент подсчета, поэтому кэш живет одну партию:
+    # иначе ходы партии зависели бы от того, какие партии сыграл тот же процесс до нее
+    solver = _solvers.get(engine.size)
+    if solver is None:
+        solver = (engine.log, ExpectimaxSolver(engine.size))
+    elif solver[0] is not engine.log:
+        solver[1].clear()
+        solver = (engine.log, solver[1])
+    _solvers[engine.size] = solver
+    return solver[1].best_move(engine.state)
+
+_rollout_solvers: Dict[int, MonteCarloSolver] = {}
+
+def montecarlo_strategy(engine: GameEngine, rng: random.Random) -> str | None:
+    # В self-play партии уже распределены по процессам, поэтому роллауты идут в текущем процессе.
+    # Число роллаутов фиксировано, без бюджета времени, а rng решателя берется из rng партии на каждом ходу:
+    # партия играется одинаково в любом процессе и при любой загрузке машины
+    solver = _rollout_solvers.get(engine.size)
+    if solver is None:
+        solver = MonteCarloSolver(engine.size, rollouts=20, time_budget=None, workers=1)
+        _rollout_solvers[engine.size] = solver
+    solver.rng.seed(rng.getrandbits(32))
+    return solver.best_move(engine.state)
+
+_tablebases: Dict[int, Tablebase | None] = {}
+
+def tablebase_strategy(engine: GameEngine, rng: random.Random) -> str | None:
+    # Ходы из сгенерированной таблицы (tablebase.py); позиции вне таблицы доигрывает expectimax
+    if engine.size not in _tablebases:
+        _tablebases[engine.size] = open_default(engine.size)
+    tablebase = _tablebases[engine.size]
+    direction = tablebase.best_move(engine.state) if tablebase is not None else None
+    return direction if direction is not None else expectimax_strategy(engine, rng)
+
+STRATEGIES: Dict[str, Strategy] = {
+    "random": random_strategy,
+    "greedy": greedy_strategy,
+    "corner": corner_strategy,
+    "search": search_strategy,
+    "expectimax": expectimax_strategy,
+    "montecarlo": montecarlo_strategy,
+    "tablebase": tablebase_strategy,
+}
@@ -0,0 +1,119 @@
+from __future__ import annotations
+from typing import Callable, Dict, List, Tuple
+
+from operator import itemgetter
+
+import bitboard
+
+# 8 симметрий квадратной доски (группа диэдра): преобразование t - биты
+# 4 - транспонировать, 1 - отразить столбцы (слева направо), 2 - отразить строки (сверху вниз), в этом порядке.
+# Ценность позиции не зависит от ориентации, поэтому поиск и таблицы могут хранить одну каноническую доску на все восемь.
+
+TRANSFORMS = range(8)
+IDENTITY = 0
+
+_VECTORS = {"u": (-1, 0), "d": (1, 0), "l": (0, -1), "r": (0, 1)}
+_BY_VECTOR = {vector: direction for direction, vector in _VECTORS.items()}
+
+def _map_position(r: int, c: int, n: int, t: int) -> Tuple[int, int]:
+    if t & 4:
+        r, c = c, r
+    if t & 1:
+        c = n - 1 - c
+    if t & 2:
+        r = n - 1 - r
+    return r, c
+
+def _map_vector(dr: int, dc: int, t: int) -> Tuple[int, int]:
+    if t & 4:
+        dr, dc = dc, dr
+    if t & 1:
+        dc = -dc
+    if t & 2:
+        dr = -dr
+    return dr, dc
+
+# Ход direction на исходной доске - ход DIRECTION_MAP[t][direction] на преобразованной
+DIRECTION_MAP: List[Dict[str, str]] = [{d: _BY_VECTOR[_map_vector(*_VECTORS[d], t)] for d in _VECTORS} for t in TRANSFORMS]
+
+def _inverse(t: int) -> int:
+    # 3x3 достаточно, чтобы различить все восемь преобразований
+    cells = [(r, c) for r in range(3) for c in range(3)]
+    return next(s for s in TRANSFORMS if all(_map_position(*_map_position(r, c, 3, t), 3, s) == (r, c) for r, c in cells))
+
+INVERSE: List[int] = [_inverse(t) for t in TRANSFORMS] # преобразование, возвращающее доску в исходную ориентацию
+
+class SymmetryTables:
+    # Перестановки клеток плоской доски (GameState.cells) для всех восьми преобразований одного размера
+    def __init__(self, size: int):
+        self.size = size
+        n = size
+        self.permutations: List[Tuple[int, ...]] = []
+        for t in TRANSFORMS:
+            source = [0] * (n * n) # клетка преобразованной доски -> клетка исходной
+            for r in range(n):
+                for c in range(n):
+                    tr, tc = _map_position(r, c, n, t)
+                    source[tr * n + tc] = r * n + c
+            self.permutations.append(tuple(source))
+        self._getters: List[Callable[[bytes], Tuple[int, ...]]] = [itemgetter(*perm) for perm in self.permutations]
+
+    def transform(self, cells: bytes, t: int) -> bytes:
+        if t == IDENTITY:
+            return cells
+        return bytes(self._getters[t](cells))
+
+    def canonical(self, cells: bytes) -> Tuple[bytes, int]:
+        # Наименьшая (лексикографически) из восьми ориентаций и преобразование, которое к ней приводит
+        best, best_t = cells, IDENTITY
+        for t in range(1, 8):
+            candidate = bytes(self._getters[t](cells))
+            if candidate < best:
+                best, best_t = candidate, t
+        return best, best_t
+
+_tables: Dict[int, SymmetryTables] = {}
+
+def symmetry_tables(size: int) -> SymmetryTables:
+    tables = _tables.get(size)
+    if tables is None:
+        tables = SymmetryTables(size)
+        _tables[size] = tables
+    return tables
+
+def transform_direction(direction: str, t: int) -> str:
+    return DIRECTION_MAP[t][direction]
+
+def inverse(t: int) -> int:
+    return INVERSE[t]
+
+# Быстрый путь 4x4 на упакованной доске: отражения строк и столбцов - табличные операции над 16-битными строками
+
+_REVERSED_ROWS = [(row & 0xF) << 12 | (row & 0xF0) << 4 | (row >> 4) & 0xF0 | row >> 12 for row in range(65536)]
+
+def mirror_columns_bits(bits: int) -> int:
+    rev = _REVERSED_ROWS
+    return rev[bits & 0xFFFF] | rev[(bits >> 16) & 0xFFFF] << 16 | rev[(bits >> 32) & 0xFFFF] << 32 | rev[bits >> 48] << 48
+
+def mirror_rows_bits(bits: int) -> int:
+    return (bits & 0xFFFF) << 48 | ((bits >> 16) & 0xFFFF) << 32 | ((bits >> 32) & 0xFFFF) << 16 | bits >> 48
+
+def transform_bits(bits: int, t: int) -> int:
+    if t & 4:
+        bits = bitboard.transpose(bits)
+    if t & 1:
+        bits = mirror_columns_bits(bits)
+    if t & 2:
+        bits = mirror_rows_bits(bits)
+    return bits
+
+def canonical_bits(bits: int) -> Tuple[int, int]:
+    # Для упакованной доски канонической считается ориентация с наименьшим числом
+    best, best_t = bits, IDENTITY
+    transposed = bitboard.transpose(bits)
+    for base, t0 in ((bits, 0), (transposed, 4)):
+        mirrored = mirror_columns_bits(base)
+        for candidate, t in ((base, t0), (mirrored, t0 | 1), (mirror_rows_bits(base), t0 | 2), (mirror_rows_bits(mirrored), t0 | 3)):
+            if candidate < best:
+                best, best_t = candidate, t
+    return best, best_t
@@ -0,0 +1,346 @@
+from __future__ import annotations
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+from engine import DIRECTIONS, GameEngine, GameState
+from symmetry import symmetry_tables
+
+# Таблица точной игры для маленьких досок. Позиция (после спавна, ход игрока) хранится в канонической ориентации,
+# упакованной по 4 бита на клетку, поэтому доска должна помещаться в 64 бита: size * size <= 16.
+# Значение - оптимальное ожидаемое число очков до конца партии или, если задан target, вероятность собрать тайл target.
+#
+# Формат файла: заголовок HEADER, затем count ключей uint64 по возрастанию и count значений float32 в том же порядке
+# (little-endian). Ключ ищется бинарным поиском прямо в отображенном в память файле.
+
+MAGIC = b"2048TB01"
+HEADER = struct.Struct("<8sBB6xQ") # сигнатура, размер доски, показатель target (0 - ожидаемые очки), число позиций
+SPAWN_2_PROBABILITY = 0.9 # как в GameEngine._pick_spawn
+CHUNK_SIZE = 5000 # позиций в одной задаче пула
+
+def default_path(size: int) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f"tablebase_{size}x{size}.bin")
+
+def pack(cells: bytes) -> int:
+    key = 0
+    for e in reversed(cells):
+        key = key << 4 | e
+    return key
+
+def unpack(key: int, size: int) -> bytes:
+    return bytes((key >> (4 * i)) & 0xF for i in range(size * size))
+
+def tile_sum(cells: bytes) -> int:
+    return sum(1 << e for e in cells if e)
+
+def _chance_value(after: bytes, target: int, child_value: Callable[[bytes], Optional[float]]) -> Optional[float]:
+    # Среднее по спавнам после хода; None - какой-то позиции нет в таблице
+    if target and max(after) >= target:
+        return 1.0
+    empty = [cell for cell, e in enumerate(after) if not e]
+    total = 0.0
+    for cell in empty:
+        for e, probability in ((1, SPAWN_2_PROBABILITY), (2, 1.0 - SPAWN_2_PROBABILITY)):
+            value = child_value(after[:cell] + bytes((e,)) + after[cell + 1:])
+            if value is None:
+                return None
+            total += probability * value
+    return total / len(empty)
+
+def _move_values(engine: GameEngine, cells: bytes, target: int, child_value: Callable[[bytes], Optional[float]]) -> Dict[str, Optional[float]]:
+    values: Dict[str, Optional[float]] = {}
+    for direction in DIRECTIONS:
+        after, score_gain, moved = engine.simulate_move(cells, direction)
+        if not moved:
+            continue
+        value = _chance_value(after, target, child_value)
+        values[direction] = value if value is None or target else value + score_gain
+    return values
+
+class Tablebase:
+    # Готовая таблица: файл отображается в память, поиск не требует загрузки и не считает дерево игры
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, self.target, self.count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or len(self._mmap) != HEADER.size + 12 * self.count:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a 2048 tablebase file")
+        view = memoryview(self._mmap)
+        keys_end = HEADER.size + 8 * self.count
+        self.keys = view[HEADER.size:keys_end].cast("Q")
+        self.values = view[keys_end:].cast("f")
+        self.engine = GameEngine(self.size) # только для сдвигов без спавна
+        self.symmetry = symmetry_tables(self.size)
+
+    def value(self, cells: bytes) -> Optional[float]:
+        if self.target and max(cells) >= self.target:
+            return 1.0
+        key = pack(self.symmetry.canonical(cells)[0])
+        i = bisect_left(self.keys, key)
+        if i < self.count and self.keys[i] == key:
+            return self.values[i]
+        return None
+
+    def score_moves(self, state: GameState) -> Dict[str, Optional[float]]:
+        return _move_values(self.engine, state.cells, self.target, self.value)
+
+    def best_move(self, state: GameState) -> Optional[str]:
+        # None - позиции нет в таблице, target уже собран (все ходы стоят 1.0) или ходов нет
+        if self.target and max(state.cells) >= self.target:
+            return None
+        scores = self.score_moves(state)
+        if not scores or None in scores.values():
+            return None
+        return max(scores, key=scores.get)
+
+    def close(self):
+        self.keys.release()
+        self.values.release()
+        self._mmap.close()
+
+class TablebaseSolver:
+    # Ходы из таблицы; позиции вне нее (или после собранного target) решает запасной решатель
+    def __init__(self, tablebase: Tablebase, fallback):
+        self.tablebase = tablebase
+        self.fallback = fallback
+        self.size = tablebase.size
+
+    def best_move(self, state: GameState) -> Optional[str]:
+        direction = self.tablebase.best_move(state)
+        if direction is None:
+            direction = self.fallback.best_move(state)
+        return direction
+
+def open_default(size: int) -> Optional[Tablebase]:
+    path = default_path(size)
+    if not os.path.exists(path):
+        return None
+    return Tablebase(path)
+
+# Генерация. Сумма тайлов растет на 2 или 4 с каждым спавном и не меняется при сдвиге, поэтому позиции делятся на слои
+# по сумме: прямой проход перечисляет достижимые позиции слой за слоем, обратный считает значения от старших слоев
+# к младшим - слою S нужны только слои S + 2 и S + 4. Каждый готовый слой сразу пишется в рабочий каталог,
+# так что прерванная генерация продолжается с последнего записанного слоя
+
+def _layer_path(work_dir: str, kind: str, layer: int) -> str:
+    return os.path.join(work_dir, f"{kind}_{layer}.bin")
+
+def _write_array(path: str, data: array):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        data.tofile(file)
+    os.replace(tmp_path, path) # файл слоя появляется целиком или не появляется вовсе
+
+def _read_array(path: str, typecode: str) -> array:
+    data = array(typecode)
+    with open(path, "rb") as file:
+        data.frombytes(file.read())
+    return data
+
+def _written_layers(work_dir: str, kind: str) -> List[int]:
+    prefix = kind + "_"
+    return sorted(int(name[len(prefix):-4]) for name in os.listdir(work_dir) if name.startswith(prefix) and name.endswith(".bin"))
+
+def _start_layers(size: int) -> Dict[int, Set[int]]:
+    # Стартовые позиции: два тайла 2 или 4 в любых клетках
+    tables = symmetry_tables(size)
+    cells_count = size * size
+    layers: Dict[int, Set[int]] = {}
+    for first in range(cells_count):
+        for second in range(first + 1, cells_count):
+            for e1 in (1, 2):
+                for e2 in (1, 2):
+                    cells = bytearray(cells_count)
+                    cells[first], cells[second] = e1, e2
+                    layers.setdefault((1 << e1) + (1 << e2), set()).add(pack(tables.canonical(bytes(cells))[0]))
+    return layers
+
+def _expand_chunk(args: Tuple[int, int, array]) -> Tuple[array, array]:
+    # Потомки позиций слоя: (ключи в слое + 2, ключи в слое + 4). Позиции с собранным target не продолжаются
+    size, target, keys = args
+    engine = GameEngine(size)
+    tables = symmetry_tables(size)
+    children: Tuple[Set[int], Set[int]] = (set(), set())
+    for key in keys:
+        cells = unpack(key, size)
+        for direction in DIRECTIONS:
+            after, _, moved = engine.simulate_move(cells, direction)
+            if not moved or (target and max(after) >= target):
+                continue
+            for cell, e in enumerate(after):
+                if e:
+                    continue
+                for spawn in (1, 2):
+                    child = after[:cell] + bytes((spawn,)) + after[cell + 1:]
+                    children[spawn - 1].add(pack(tables.canonical(child)[0]))
+    return array("Q", sorted(children[0])), array("Q", sorted(children[1]))
+
+_solved_layers: Dict[str, Tuple[array, array]] = {} # кэш слоев в процессе пула: path -> (ключи, значения)
+
+def _layer_lookup(work_dir: str, layer: int) -> Tuple[array, array]:
+    path = _layer_path(work_dir, "values", layer)
+    loaded = _solved_layers.get(path)
+    if loaded is None:
+        if len(_solved_layers) >= 4: # процессу нужны два соседних слоя, старые выбрасываются
+            _solved_layers.clear()
+        keys_path = _layer_path(work_dir, "keys", layer)
+        if os.path.exists(keys_path):
+            loaded = (_read_array(keys_path, "Q"), _read_array(path, "f"))
+        else: # слой пуст - из него нет достижимых позиций
+            loaded = (array("Q"), array("f"))
+        _solved_layers[path] = loaded
+    return loaded
+
+def _solve_chunk(args: Tuple[str, int, int, int, array]) -> array:
+    work_dir, size, target, layer, keys = args
+    engine = GameEngine(size)
+    tables = symmetry_tables(size)
+    next_layers = {2: _layer_lookup(work_dir, layer + 2), 4: _layer_lookup(work_dir, layer + 4)}
+
+    values = array("f")
+    for key in keys:
+        cells = unpack(key, size)
+        current = tile_sum(cells)
+
+        def child_value(child: bytes) -> Optional[float]:
+            child_keys, child_values = next_layers[tile_sum(child) - current]
+            child_key = pack(tables.canonical(child)[0])
+            i = bisect_left(child_keys, child_key)
+            if i < len(child_keys) and child_keys[i] == child_key:
+                return child_values[i]
+            return None
+
+        move_values = _move_values(engine, cells, target, child_value)
+        if None in move_values.values():
+            raise RuntimeError(f"tablebase layer {layer} references a position missing from layer {layer + 2} or {layer + 4}")
+        values.append(max(move_values.values(), default=0.0))
+    return values
+
+def _chunks(keys: array) -> Iterator[array]:
+    for start in range(0, len(keys), CHUNK_SIZE):
+        yield keys[start:start + CHUNK_SIZE]
+
+def _map(executor: Optional[ProcessPoolExecutor], func, jobs: List[tuple]) -> Iterator:
+    return executor.map(func, jobs) if executor is not None else map(func, jobs)
+
+def _forward(size: int, target: int, work_dir: str, executor: Optional[ProcessPoolExecutor], log: Callable[[str], None]):
+    done_path = os.path.join(work_dir, "forward.done")
+    if os.path.exists(done_path):
+        return
+
+    written = _written_layers(work_dir, "keys")
+    pending = _start_layers(size)
+    if written:
+        # Продолжение: слои до последнего записанного готовы, в старшие еще попадут потомки двух последних слоев
+        last = written[-1]
+        pending = {layer: keys for layer, keys in pending.items() if layer > last}
+        for layer in (last - 2, last):
+            if layer in written:
+                _expand_into(size, target, layer, _read_array(_layer_path(work_dir, "keys", layer), "Q"), pending, executor, keep_above=last)
+
+    while pending:
+        layer = min(pending)
+        keys = array("Q", sorted(pending.pop(layer)))
+        _write_array(_layer_path(work_dir, "keys", layer), keys)
+        log(f"forward: layer {layer}: {len(keys)} positions")
+        _expand_into(size, target, layer, keys, pending, executor, keep_above=layer)
+
+    with open(done_path, "w"):
+        pass
+
+def _expand_into(size: int, target: int, layer: int, keys: array, pending: Dict[int, Set[int]], executor: Optional[ProcessPoolExecutor], keep_above: int):
+    for plus2, plus4 in _map(executor, _expand_chunk, [(size, target, chunk) for chunk in _chunks(keys)]):
+        for offset, children in ((2, plus2), (4, plus4)):
+            if children and layer + offset > keep_above:
+                pending.setdefault(layer + offset, set()).update(children)
+
+def _backward(size: int, target: int, work_dir: str, executor: Optional[ProcessPoolExecutor], log: Callable[[str], None]):
+    solved = set(_written_layers(work_dir, "values"))
+    for layer in reversed(_written_layers(work_dir, "keys")):
+        if layer in solved:
+            continue
+        keys = _read_array(_layer_path(work_dir, "keys", layer), "Q")
+        values = array("f")
+        for chunk_values in _map(executor, _solve_chunk, [(work_dir, size, target, layer, chunk) for chunk in _chunks(keys)]):
+            values.extend(chunk_values)
+        _write_array(_layer_path(work_dir, "values", layer), values)
+        log(f"backward: layer {layer}: {len(values)} values")
+
+def _merge(size: int, target: int, work_dir: str, output: str) -> int:
+    # Канонические позиции разных слоев различны (у них разные суммы), поэтому достаточно общей сортировки по ключу
+    keys = array("Q")
+    values = array("f")
+    for layer in _written_layers(work_dir, "keys"):
+        keys.extend(_read_array(_layer_path(work_dir, "keys", layer), "Q"))
+        values.extend(_read_array(_layer_path(work_dir, "values", layer), "f"))
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    sorted_keys = array("Q", (keys[i] for i in order))
+    sorted_values = array("f", (values[i] for i in order))
+    if sys.byteorder != "little":
+        sorted_keys.byteswap()
+        sorted_values.byteswap()
+
+    tmp_path = output + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, size, target, len(sorted_keys)))
+        sorted_keys.tofile(file)
+        sorted_values.tofile(file)
+    os.replace(tmp_path, output)
+    return len(sorted_keys)
+
+def generate(size: int, output: str, target: int = 0, work_dir: str | None = None, workers: int | None = None, log: Callable[[str], None] = lambda message: None) -> int:
+    # target - показатель степени тайла (0 - ожидаемые очки). Возвращает число позиций в таблице
+    if size * size > 16:
+        raise ValueError("tablebase keys hold at most 16 cells")
+    work_dir = work_dir or output + ".work"
+    os.makedirs(work_dir, exist_ok=True)
+    meta_path = os.path.join(work_dir, "meta.txt")
+    meta = f"{size} {target}"
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as file:
+            if file.read().strip() != meta:
+                raise ValueError(f"{work_dir} holds a generation with different parameters")
+    else:
+        with open(meta_path, "w", encoding="utf-8") as file:
+            file.write(meta)
+
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        _forward(size, target, work_dir, executor, log)
+        _backward(size, target, work_dir, executor, log)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return _merge(size, target, work_dir, output)
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a 2048 tablebase for perfect play on small boards")
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--target", type=int, default=0, help="tile value to reach: store win probability instead of expected score")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("-o", "--output", default=None, help="output file (default: tablebase_NxN.bin next to the game)")
+    parser.add_argument("--work-dir", default=None, help="directory for per-layer checkpoints (default: OUTPUT.work)")
+    args = parser.parse_args(argv)
+
+    if args.target and (args.target & (args.target - 1) or args.target < 8):
+        parser.error("target must be a power of two, at least 8")
+    target = args.target.bit_length() - 1 if args.target else 0
+    output = args.output or default_path(args.size)
+
+    start = time.perf_counter()
+    count = generate(args.size, output, target, args.work_dir, args.workers, log=lambda message: print(message, file=sys.stderr))
+    print(f"{count} positions written to {output} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())